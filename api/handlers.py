@@ -26,6 +26,7 @@ from piston.utils import rc
 
 from app import lastfm
 from app.models import *
+from app.tools import decode_page_token
 
 
 class ApiResource(Resource):
@@ -166,6 +167,11 @@ class ReleasesHandler(AnonymousBaseHandler):
         offset = max(0, int(request.GET.get('offset', 0)))
         mbid = request.GET.get('mbid', '')
         since = request.GET.get('since', '')
+        after = request.GET.get('after')
+        if after is not None:
+            after = decode_page_token(after)
+            if after is None:
+                return rc.BAD_REQUEST
 
         if mbid:
             try:
@@ -194,10 +200,12 @@ class ReleasesHandler(AnonymousBaseHandler):
                     })
             releases = q[:limit]
         elif artist or user:
-            releases = ReleaseGroup.get(artist=artist, user=user, limit=limit, offset=offset)
+            releases = ReleaseGroup.get(
+                artist=artist, user=user, limit=limit, offset=offset, after=after)
         else:
             today = int(date.today().strftime('%Y%m%d'))
-            releases = ReleaseGroup.get_calendar(date=today, limit=limit, offset=offset)
+            releases = ReleaseGroup.get_calendar(
+                date=today, limit=limit, offset=offset, after=after)
 
         return [{
                 'mbid': release.mbid,
@@ -209,7 +217,8 @@ class ReleasesHandler(AnonymousBaseHandler):
                     'name': release.artist_name,
                     'sort_name': release.artist_sort_name,
                     'disambiguation': release.artist_disambiguation,
-                    }
+                    },
+                'cursor': release.page_token(),
                 } for release in releases]
 
 
@@ -274,6 +283,7 @@ class UserHandler(BaseHandler):
 
         user = request.user
         profile = user.get_profile()
+        types = profile.get_types()
 
         if 'email' in request.POST:
             user.email = request.POST['email'].lower().strip()
@@ -298,6 +308,8 @@ class UserHandler(BaseHandler):
         with transaction.commit_on_success():
             user.save()
             profile.save()
+        if profile.get_types() != types:
+            Timeline.refill(user_id=user.id)
 
         response = rc.ALL_OK
         response.content = {
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk cache for web service responses.
+
+The cache is shared by the web workers and the daemon. Each entry is a
+file named after the SHA-1 of its key, stored in the same two-level
+directory layout as the covers. Files are written to a temporary name
+and renamed, so readers never see a partial entry.
+
+The modification time of a file is its expiration time, the access
+time is updated on each hit and used to evict the least recently used
+entries once the cache grows too large. An empty file is a negative
+entry, e.g. for a resource which does not exist.
+
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+MAX_SIZE = 512 * 1024 * 1024 # bytes
+EVICT_PROBABILITY = 0.001 # per set() call
+
+
+class Cache(object):
+
+    def __init__(self, name, max_size=MAX_SIZE):
+        base = os.path.abspath(os.path.dirname(__file__) + '/..')
+        self._root = os.path.join(base, 'cache', name)
+        self._max_size = max_size
+
+    def get(self, key):
+        """Return (found, data), data is None for negative entries."""
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            now = time.time()
+            if st.st_mtime < now:
+                os.remove(path)
+                return False, None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Bump the access time for LRU, keep the expiration time.
+            os.utime(path, (now, st.st_mtime))
+        except (IOError, OSError):
+            return False, None
+        return True, data or None
+
+    def set(self, key, data, ttl):
+        """Store data for ttl seconds, use data=None for negative entries."""
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data or '')
+            now = time.time()
+            os.utime(tmp, (now, now + ttl))
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+
+        if random.random() < EVICT_PROBABILITY:
+            self.evict()
+
+    def evict(self):
+        """Remove expired entries and trim the cache to 90% of its size.
+
+        Only one process evicts at a time, others return immediately.
+
+        """
+        if not os.path.exists(self._root):
+            return
+        with open(os.path.join(self._root, '.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return
+            try:
+                self._evict()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _evict(self):
+        now = time.time()
+        entries, total = [], 0
+        for dirpath, dirnames, filenames in os.walk(self._root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                    if filename.startswith('.'):
+                        # Abandoned temporary files.
+                        if filename != '.lock' and st.st_atime < now - 3600:
+                            os.remove(path)
+                        continue
+                    if st.st_mtime < now:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+
+        if total <= self._max_size:
+            return
+        entries.sort()
+        target = self._max_size * 9 // 10
+        for atime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= target:
+                break
+
+    def _path(self, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._root, digest[0:2], digest[2:4], digest)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""HTTP client with persistent connections and gzip support.
+
+urllib2 opens a new connection for each request and never asks for a
+compressed response. The web services we query serve lots of small
+XML documents, the handshake and the uncompressed payload dominate.
+
+Connections are pooled per thread and per host and kept alive between
+requests. The response body is decompressed as it is being read.
+
+"""
+
+import httplib
+import socket
+import StringIO
+import threading
+from urllib import urlencode as _urlencode
+from urllib2 import HTTPError
+from urlparse import urljoin, urlsplit
+import zlib
+
+USER_AGENT = 'muspy/2.0'
+TIMEOUT = 10 # seconds
+CHUNK_SIZE = 16384
+MAX_REDIRECTS = 5
+
+_local = threading.local()
+
+
+def get(url, headers=None):
+    """Send a GET request, return the Response.
+
+    Raise HTTPError if the server returns an error, just like urlopen().
+
+    """
+    for i in xrange(MAX_REDIRECTS + 1):
+        response = _request(url, headers)
+        if response.status in (301, 302, 303, 307) and response.getheader('location'):
+            response.close()
+            url = urljoin(url, response.getheader('location'))
+            continue
+        if response.status >= 400:
+            # Read the error body so that the connection can be reused.
+            body = response.read()
+            raise HTTPError(url, response.status, response.reason,
+                            response.msg, StringIO.StringIO(body))
+        return response
+    raise HTTPError(url, response.status, 'Too many redirects', response.msg, None)
+
+def urlencode(params):
+    """urllib.urlencode() which accepts unicode values."""
+    if isinstance(params, dict):
+        params = params.items()
+    return _urlencode([(k, v.encode('utf-8') if isinstance(v, unicode) else v)
+                       for k, v in params])
+
+def close():
+    """Close all connections opened by the current thread."""
+    connections = getattr(_local, 'connections', {})
+    for connection in connections.values():
+        connection.close()
+    connections.clear()
+
+
+class Response(object):
+    """Wraps httplib.HTTPResponse, decompresses the body on the fly.
+
+    Iterate over the response to get the body in chunks as they arrive.
+    The connection returns to the pool once the body is read in full.
+
+    """
+    def __init__(self, response, connection):
+        self._response = response
+        self._connection = connection
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+        self.bytes_read = 0 # on the wire, before decompression
+        encoding = response.getheader('content-encoding', '').lower()
+        if encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        else:
+            self._decompressor = None
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                if self._decompressor:
+                    chunk = self._decompressor.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if self._decompressor:
+                chunk = self._decompressor.flush()
+                if chunk:
+                    yield chunk
+        except:
+            # Don't leave a half-read response on a pooled connection.
+            self._connection.close()
+            raise
+        finally:
+            if not self._response.isclosed():
+                # The body was not read in full.
+                self._connection.close()
+            if self._response.will_close:
+                self._connection.close()
+
+    def read(self):
+        return ''.join(self)
+
+    def close(self):
+        for chunk in self:
+            pass
+
+
+def _request(url, headers):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    all_headers = {
+        'User-Agent': USER_AGENT,
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+        }
+    all_headers.update(headers or {})
+
+    connection, reused = _get_connection(parts.scheme, parts.netloc)
+    try:
+        connection.request('GET', path, headers=all_headers)
+        response = connection.getresponse()
+    except (httplib.HTTPException, socket.error):
+        connection.close()
+        if not reused:
+            raise
+        # The server has closed the idle connection, try again once.
+        connection, reused = _get_connection(parts.scheme, parts.netloc)
+        try:
+            connection.request('GET', path, headers=all_headers)
+            response = connection.getresponse()
+        except:
+            connection.close()
+            raise
+    return Response(response, connection)
+
+def _get_connection(scheme, netloc):
+    """Return a pooled connection and whether it was used before."""
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+    key = (scheme, netloc)
+    connection = _local.connections.get(key)
+    if connection is not None and connection.sock is not None:
+        return connection, True
+
+    if scheme == 'https':
+        connection = httplib.HTTPSConnection(netloc, timeout=TIMEOUT)
+    else:
+        connection = httplib.HTTPConnection(netloc, timeout=TIMEOUT)
+    _local.connections[key] = connection
+    return connection, False
@@ -65,6 +65,7 @@ class SettingsForm(forms.Form):
                 self.profile.save()
             self.profile.send_activation_email()
         changed = False
+        types = self.profile.get_types()
         if self.cleaned_data['new_password']:
             self.profile.user.set_password(self.cleaned_data['new_password'])
             self.profile.user.save()
@@ -94,6 +95,8 @@ class SettingsForm(forms.Form):
             changed = True
         if changed:
             self.profile.save()
+        if self.profile.get_types() != types:
+            Timeline.refill(user_id=self.profile.user.id)
 
 class SignInForm(AuthenticationForm):
 
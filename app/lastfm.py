@@ -16,11 +16,11 @@
 # along with muspy.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
-from urllib import urlencode
-from urllib2 import Request, urlopen
-from xml.etree import ElementTree as et
 
-from settings import LASTFM_API_KEY
+from settings import LASTFM_API_KEY, LASTFM_URL
+
+from app import client, ratelimit
+from app.tools import iterparse
 
 
 def has_user(username):
@@ -28,32 +28,33 @@ def has_user(username):
 
 def get_artists(username, period, limit, page):
     try:
-        xml = _fetch(
+        chunks = _fetch(
             'user.getTopArtists', user=username,
             period=period, limit=limit, page=page)
     except:
         return None
 
     try:
-        root = et.fromstring(xml)
-    except:
+        items = iterparse(chunks)
+        if next(items).get('status') != 'ok':
+            return None
+        artists = next(items)
+        if artists.tag != 'topartists' or int(artists.get('page')) != page:
+            return []
+        artists = [_parse_artist(element) for element in items]
+    except (SyntaxError, StopIteration, TypeError, ValueError):
+        # Malformed XML.
         return []
-
-    if not 'status' in root.attrib or root.get('status') != 'ok':
+    except:
         return None
 
-    artists = root.find('topartists')
-    if artists is None or int(artists.get('page')) != page:
-        return []
-
-    artists = [_parse_artist(element) for element in root.findall('topartists/artist')]
     return [artist for artist in artists if 'name' in artist or 'mbid' in artist]
 
 def get_cover_urls(artist, album):
     # Remove the trailing ' (X)' from the album.
     album = re.sub(r'(^.+)\s+\([^\)]+\)$', r'\1', album)
     try:
-        xml = _fetch('album.getInfo', artist=artist, album=album)
+        xml = _fetch('album.getInfo', artist=artist, album=album).read()
     except:
         return None
 
@@ -67,21 +68,13 @@ def get_cover_urls(artist, album):
     return res
 
 def _fetch(method, **kw):
-    url = 'http://ws.audioscrobbler.com/2.0/'
+    """Send the request, return the response to be read in chunks."""
+    url = LASTFM_URL + '/2.0/'
     params = {'method': method, 'api_key': LASTFM_API_KEY}
     params.update(kw)
-    url += '?' + _urlencode(params)
-
-    request = Request(url, headers = {'User-Agent': 'muspy/2.0'})
-    response = urlopen(request)
-    return response.read()
+    url += '?' + client.urlencode(params)
 
-# TODO: duplicate in musicbrainz.py
-def _urlencode(params):
-    if isinstance(params, dict):
-        params = params.items()
-    return urlencode([(k, v.encode('utf-8') if isinstance(v, unicode) else v)
-                      for k, v in params])
+    return ratelimit.lastfm.get(url)
 
 def _parse_artist(element):
     d = {}
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Show or rebuild the artist name resolution index.
+
+The batch adds and the Last.fm imports resolve the artist names with the
+ArtistName table before searching MB. New artists and searches update
+it, the rebuild resolves the names of all our artists again.
+
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from app.models import ArtistName
+
+
+class Command(BaseCommand):
+
+    help = 'Show the number of resolved artist names, or rebuild them.'
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild', action='store_true', default=False,
+                    help='Resolve the names of all artists, keep the searched names.'),
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = ArtistName.rebuild()
+            self.stdout.write('Resolved the names of the artists, %d names\n' % count)
+
+        q = ArtistName.objects.all()
+        self.stdout.write('Names:     %d\n' % q.count())
+        self.stdout.write('Ambiguous: %d\n' % q.filter(mbid='').count())
+        self.stdout.write('Searched:  %d\n' % q.filter(searched=True).count())
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Inspect or reset the progress of the release check cycle."""
+
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from app.models import Checkpoint
+
+
+class Command(BaseCommand):
+
+    help = 'Show the release check cycle checkpoint, or reset it.'
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+                    help='Forget the checkpoint, the daemon starts a new cycle.'),
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint.get()
+        if checkpoint is None:
+            self.stdout.write('No cycle in progress\n')
+            return
+        if options['reset']:
+            Checkpoint.reset()
+            self.stdout.write('Reset the cycle started at %s\n' % checkpoint.started)
+            return
+
+        running = datetime.now() - checkpoint.started
+        self.stdout.write('Started:        %s (%s ago)\n' % (checkpoint.started, running))
+        self.stdout.write('Updated:        %s\n' % checkpoint.updated)
+        self.stdout.write('Update artists: %s\n' % ('yes' if checkpoint.update_artists else 'no'))
+        self.stdout.write('Last artist:    %s\n' % (checkpoint.artist_mbid or '-'))
+        self.stdout.write('Artists:        %d\n' % checkpoint.checked_artists)
+        self.stdout.write('Release groups: %d\n' % checkpoint.checked_release_groups)
+        self.stdout.write('Notifications:  %d\n' % checkpoint.sent_notifications)
+        self.stdout.write('Unchanged:      %d artists, %.1fs saved\n'
+                          % (checkpoint.skipped_artists, checkpoint.saved_time))
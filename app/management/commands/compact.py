@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Archive artists nobody follows.
+
+Orphaned artists and their release groups are written to a gzipped
+file in archive/, one JSON object per artist, and deleted from the
+database. If someone follows an archived artist again, it is fetched
+from MB as a new one.
+
+Artists which were never checked yet (just added, maybe about to be
+followed) and artists with starred release groups are kept.
+
+"""
+
+from datetime import datetime
+import gzip
+import json
+from optparse import make_option
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from daemon import releases, scheduler
+
+BATCH_SIZE = 500 # artists per transaction
+
+# Checked artists with no followers and no starred release groups.
+ORPHAN = """
+    "app_artist"."last_checked" IS NOT NULL
+    AND NOT EXISTS (
+        SELECT 1 FROM "app_userartist"
+        WHERE "app_userartist"."artist_id" = "app_artist"."id")
+    AND NOT EXISTS (
+        SELECT 1 FROM "app_releasegroup"
+        JOIN "app_star" ON "app_star"."release_group_id" = "app_releasegroup"."id"
+        WHERE "app_releasegroup"."artist_id" = "app_artist"."id")
+    """
+
+
+class Command(BaseCommand):
+
+    help = 'Archive artists nobody follows and report the savings.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', default=False,
+                    help='Only report what would be archived.'),
+        make_option('--vacuum', action='store_true', default=False,
+                    help='Rebuild the database to return the space to the OS.'),
+        )
+
+    def handle(self, *args, **options):
+        cursor = connection.cursor()
+        size_before = _db_size(cursor)
+        ids = _orphans(cursor)
+        artists = release_groups = requests = 0
+        path = None
+        if not options['dry_run'] and ids:
+            base = os.path.abspath(os.path.dirname(__file__) + '/../../..')
+            dirname = os.path.join(base, 'archive')
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            name = datetime.now().strftime('artists-%Y%m%d-%H%M%S.json.gz')
+            path = os.path.join(dirname, name)
+            f = gzip.open(path, 'wb')
+        try:
+            for i in xrange(0, len(ids), BATCH_SIZE):
+                batch = ids[i:i + BATCH_SIZE]
+                with transaction.commit_on_success():
+                    if path:
+                        batch = _lock(cursor, batch)
+                    for artist in _load(cursor, batch):
+                        artists += 1
+                        release_groups += len(artist['release_groups'])
+                        # A full check fetches every page of release groups.
+                        requests += 1 + len(artist['release_groups']) // releases.LIMIT
+                        if path:
+                            f.write(json.dumps(artist) + '\n')
+                    if path:
+                        _delete(cursor, batch)
+        finally:
+            if path:
+                f.close()
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write('%s %d artists and %d release groups\n'
+                          % (verb, artists, release_groups))
+        if path:
+            self.stdout.write('Archive: %s\n' % path)
+        days = scheduler.ORPHAN_INTERVAL.days
+        self.stdout.write('Saves %d MB requests per full cycle, '
+                          '%.1f per day at the %d-day orphan interval\n'
+                          % (requests, float(requests) / days, days))
+
+        if options['dry_run'] or size_before is None:
+            return
+        if options['vacuum']:
+            cursor.execute('VACUUM')
+        size_after = _db_size(cursor)
+        self.stdout.write('Database: %.1f MB -> %.1f MB in use\n'
+                          % (size_before / 1048576.0, size_after / 1048576.0))
+        if not options['vacuum']:
+            self.stdout.write('Run with --vacuum to return the free pages to the OS\n')
+
+def _orphans(cursor, ids=None):
+    """Return the ids of the orphaned artists, only among ids if given."""
+    sql = 'SELECT "id" FROM "app_artist" WHERE ' + ORPHAN
+    params = []
+    if ids is not None:
+        sql += 'AND "id" IN (%s)' % ', '.join(['%s'] * len(ids))
+        params = ids
+    cursor.execute(sql + 'ORDER BY "id"', params)
+    return [row[0] for row in cursor.fetchall()]
+
+def _lock(cursor, ids):
+    """Take the write lock, return the ids which are still orphaned.
+
+    Someone could have followed or starred an artist since _orphans(),
+    nobody can until the transaction ends.
+
+    """
+    # The first write of the transaction takes the lock.
+    cursor.execute(
+        """
+        DELETE FROM "app_notification"
+        WHERE "release_group_id" IN (
+            SELECT "app_releasegroup"."id" FROM "app_releasegroup"
+            JOIN "app_artist" ON "app_artist"."id" = "app_releasegroup"."artist_id"
+            WHERE "app_artist"."id" IN (%s) AND %s)
+        """ % (', '.join(['%s'] * len(ids)), ORPHAN), ids)
+    return _orphans(cursor, ids)
+
+def _load(cursor, ids):
+    """Return the artists with their release groups as dicts."""
+    if not ids:
+        return []
+    params = ', '.join(['%s'] * len(ids))
+    cursor.execute(
+        """
+        SELECT "id", "mbid", "name", "sort_name", "disambiguation", "last_changed"
+        FROM "app_artist"
+        WHERE "id" IN (%s)
+        """ % params, ids)
+    artists = {}
+    for id, mbid, name, sort_name, disambiguation, last_changed in cursor.fetchall():
+        artists[id] = {
+            'mbid': mbid, 'name': name, 'sort_name': sort_name,
+            'disambiguation': disambiguation,
+            'last_changed': str(last_changed) if last_changed else None,
+            'release_groups': []}
+    cursor.execute(
+        """
+        SELECT "artist_id", "mbid", "name", "type", "date", "is_deleted"
+        FROM "app_releasegroup"
+        WHERE "artist_id" IN (%s)
+        """ % params, ids)
+    for artist_id, mbid, name, type, date, is_deleted in cursor.fetchall():
+        artists[artist_id]['release_groups'].append({
+            'mbid': mbid, 'name': name, 'type': type, 'date': date,
+            'is_deleted': bool(is_deleted)})
+    return [artists[id] for id in sorted(artists)]
+
+def _delete(cursor, ids):
+    """Delete the artists and their rows, see _lock()."""
+    if not ids:
+        return
+    params = ', '.join(['%s'] * len(ids))
+    # Pending notifications are for users who no longer follow the artist.
+    cursor.execute(
+        """
+        DELETE FROM "app_notification"
+        WHERE "release_group_id" IN (
+            SELECT "id" FROM "app_releasegroup" WHERE "artist_id" IN (%s))
+        """ % params, ids)
+    cursor.execute(
+        """
+        DELETE FROM "app_timeline"
+        WHERE "release_group_id" IN (
+            SELECT "id" FROM "app_releasegroup" WHERE "artist_id" IN (%s))
+        """ % params, ids)
+    cursor.execute(
+        """
+        DELETE FROM "app_releasegroup"
+        WHERE "artist_id" IN (%s)
+        """ % params, ids)
+    cursor.execute(
+        """
+        DELETE FROM "app_artist"
+        WHERE "id" IN (%s)
+        """ % params, ids)
+
+def _db_size(cursor):
+    """Return the number of bytes in use by an SQLite database, or None."""
+    if connection.vendor != 'sqlite':
+        return None
+    cursor.execute('PRAGMA page_size')
+    page_size = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_count')
+    page_count = cursor.fetchone()[0]
+    cursor.execute('PRAGMA freelist_count')
+    free_count = cursor.fetchone()[0]
+    return (page_count - free_count) * page_size
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""List the jobs which failed too many times, or queue them again."""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from app.models import DeadJob
+
+
+class Command(BaseCommand):
+
+    help = 'List the failed jobs with their last error, or queue them again.'
+    option_list = BaseCommand.option_list + (
+        make_option('--requeue', action='store_true', default=False,
+                    help='Queue the failed jobs again and forget them.'),
+        make_option('--errors', action='store_true', default=False,
+                    help='Show the full errors.'),
+        )
+
+    def handle(self, *args, **options):
+        jobs = DeadJob.objects.order_by('failed')
+        if options['requeue']:
+            count = 0
+            for job in jobs:
+                job.requeue()
+                count += 1
+            self.stdout.write('Queued %d jobs\n' % count)
+            return
+
+        for job in jobs:
+            error = job.error.strip() or '-'
+            if not options['errors']:
+                error = error.splitlines()[-1]
+            self.stdout.write('%s  type %d  %d attempts  %s\n  %s\n'
+                              % (job.failed, job.type, job.attempts, job.data, error))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Load MusicBrainz dump files for the offline release check."""
+
+from optparse import make_option
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from daemon import dump
+
+
+class Command(BaseCommand):
+
+    args = '<file or directory> ...'
+    help = 'Load dump files, apply new incremental files from a directory.'
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', default=False,
+                    help='Replace the loaded entities instead of updating them.'),
+        )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Specify the dump files or directories')
+        for path in args:
+            if os.path.isdir(path):
+                count = dump.apply_dir(path)
+                self.stdout.write('Applied %d new files from %s\n' % (count, path))
+            elif os.path.exists(path):
+                count = dump.load(path, full=options['full'])
+                self.stdout.write('Loaded %d entities from %s\n' % (count, path))
+            else:
+                raise CommandError('%s does not exist' % path)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check the timelines of the users, fix or rebuild them.
+
+The timeline is updated along with the release groups, the follows, the
+stars and the release types, see Timeline. A crash between the two or a
+writer which does not refill() it leaves stale rows, the check compares
+each row with the release groups and lists the users with stale rows.
+
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Timeline
+
+
+class Command(BaseCommand):
+
+    help = 'Check the timelines of the users, fix or rebuild them.'
+    option_list = BaseCommand.option_list + (
+        make_option('--fix', action='store_true', default=False,
+                    help='Refill the timelines of the users with stale rows.'),
+        make_option('--rebuild', action='store_true', default=False,
+                    help='Refill all timelines.'),
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rows = Timeline.refill()
+            self.stdout.write('Rebuilt the timelines, %d rows\n' % rows)
+            return
+
+        user_ids = Timeline.check()
+        if not user_ids:
+            self.stdout.write('All timelines are up to date\n')
+            return
+        if not options['fix']:
+            raise CommandError('%d users have stale timelines, run with --fix'
+                               % len(user_ids))
+        for user_id in user_ids:
+            Timeline.refill(user_id=user_id)
+        self.stdout.write('Fixed the timelines of %d users\n' % len(user_ids))
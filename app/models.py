@@ -18,19 +18,18 @@
 import random
 from smtplib import SMTPException
 import string
-from time import sleep
 
 from django.contrib.auth.models import User
 from django.core.mail import EmailMultiAlternatives
 from django.db import connection, IntegrityError, models, transaction
 from django.db.backends.signals import connection_created
-from django.db.models import Count, Q
+from django.db.models import Count, F, Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 
 import app.musicbrainz as mb
-from app.tools import date_to_iso8601, date_to_str, str_to_date
+from app.tools import date_to_iso8601, date_to_str, encode_page_token, normalize_name, str_to_date
 
 
 class Artist(models.Model):
@@ -41,6 +40,16 @@ class Artist(models.Model):
     disambiguation = models.CharField(max_length=512)
     users = models.ManyToManyField(User, through='UserArtist')
 
+    # Check scheduling, see daemon/scheduler.py
+    followers = models.IntegerField(default=0)
+    last_checked = models.DateTimeField(null=True)
+    last_changed = models.DateTimeField(null=True)
+    next_check = models.DateTimeField(null=True, db_index=True)
+    lease_owner = models.CharField(max_length=64, default='')
+    lease_until = models.DateTimeField(null=True)
+    # Release groups fingerprint, see daemon/releases.py
+    fingerprint = models.TextField(default='')
+
     blacklisted = [
         '89ad4ac3-39f7-470e-963a-56509c546377', # Various Artists
         'fe5b7087-438f-4e7e-afaf-6d93c8c888b2',
@@ -85,18 +94,11 @@ class Artist(models.Model):
         if not artist_data:
             raise cls.Unknown
 
-        artist = Artist(
-            mbid=mbid, name=artist_data['name'], sort_name=artist_data['sort-name'],
-            disambiguation=artist_data.get('disambiguation', ''))
-        try:
-            artist.save()
-        except IntegrityError:
-            # The artist was added while we were querying MB.
-            return cls.objects.get(mbid=mbid)
+        artist, created = cls.add(mbid, artist_data)
+        if not created:
+            return artist
 
         # Add a few release groups immediately.
-        # Sleep 1s to comply with the MB web service.
-        sleep(1)
         LIMIT = 100
         release_groups = mb.get_release_groups(mbid, limit=LIMIT, offset=0)
         if release_groups:
@@ -119,41 +121,278 @@ class Artist(models.Model):
 
         return artist
 
+    @classmethod
+    def add(cls, mbid, artist_data):
+        """Save the artist without its release groups, return (artist, created)."""
+        artist = Artist(
+            mbid=mbid, name=artist_data['name'], sort_name=artist_data['sort-name'],
+            disambiguation=artist_data.get('disambiguation') or '')
+        try:
+            artist.save()
+        except IntegrityError:
+            # The artist was added while we were querying MB.
+            return cls.objects.get(mbid=mbid), False
+        ArtistName.add_artist(artist)
+        return artist, True
+
     @classmethod
     def get_by_user(cls, user):
         # TODO: paging
         return cls.objects.filter(users=user).order_by('sort_name')[:4000]
 
 
+class ArtistName(models.Model):
+    """Artist names resolved to mbids without searching MB.
+
+    A name resolves to an artist if an MB search for it found only this
+    artist, or if the first result matched it exactly and the second one
+    didn't, see jobs.add_artist(). Otherwise the mbid is empty, the name
+    is ambiguous. Until a name is searched, it resolves to the only
+    artist we have with this name, unless the artist has a
+    disambiguation (MB requires one when several artists share a name).
+    See daemon/jobs.py for the lookups and the expiry.
+
+    """
+    name = models.CharField(max_length=512, unique=True) # see tools.normalize_name()
+    mbid = models.CharField(max_length=36) # empty if ambiguous
+    searched = models.BooleanField(default=False) # the outcome of an MB search
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def add_artist(cls, artist):
+        """Resolve the name to a new artist, unless the name is known.
+
+        A known name which was not searched resolves to another artist,
+        it becomes ambiguous.
+
+        """
+        name = normalize_name(artist.name)
+        mbid = '' if artist.disambiguation else artist.mbid
+        try:
+            cls(name=name, mbid=mbid).save()
+        except IntegrityError:
+            q = cls.objects.filter(name=name, searched=False).exclude(mbid=artist.mbid)
+            q.update(mbid='')
+
+    @classmethod
+    def found(cls, name, mbid):
+        """Save the outcome of a search, mbid is empty if it was ambiguous."""
+        name = normalize_name(name)
+        try:
+            row = cls.objects.get(name=name)
+        except cls.DoesNotExist:
+            row = cls(name=name)
+        row.mbid = mbid
+        row.searched = True
+        try:
+            row.save()
+        except IntegrityError:
+            # Searched meanwhile.
+            pass
+
+    @classmethod
+    def rebuild(cls):
+        """Resolve the names of all our artists, keep the searched names.
+
+        Return the number of names.
+
+        """
+        mbids = {}
+        q = Artist.objects.values_list('mbid', 'name', 'disambiguation').iterator()
+        for mbid, name, disambiguation in q:
+            name = normalize_name(name)
+            # Several artists or a disambiguation make the name ambiguous.
+            mbids[name] = '' if name in mbids or disambiguation else mbid
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM "app_artistname" WHERE NOT "searched"')
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO "app_artistname" ("name", "mbid", "searched", "updated")
+                VALUES (%s, %s, 0, datetime('now', 'localtime'))
+                """, mbids.items())
+        return len(mbids)
+
+
+class Checkpoint(models.Model):
+    """Progress of the release check cycle, see daemon/releases.py.
+
+    There is at most one row, it is updated in the same transaction as
+    the schedule of each checked artist.
+
+    """
+    started = models.DateTimeField()
+    updated = models.DateTimeField()
+    update_artists = models.BooleanField()
+    artist_mbid = models.CharField(max_length=36) # last checked artist
+    checked_artists = models.IntegerField(default=0)
+    checked_release_groups = models.IntegerField(default=0)
+    sent_notifications = models.IntegerField(default=0)
+    skipped_artists = models.IntegerField(default=0) # unchanged, not diffed
+    skipped_pages = models.IntegerField(default=0)
+    diffed_pages = models.IntegerField(default=0)
+    diff_time = models.FloatField(default=0.0) # seconds
+
+    @classmethod
+    def get(cls):
+        try:
+            return cls.objects.order_by('id')[0]
+        except IndexError:
+            return None
+
+    @classmethod
+    def reset(cls):
+        cls.objects.all().delete()
+
+    @property
+    def saved_time(self):
+        """Estimate the database time saved by not diffing the skipped pages."""
+        if not self.diffed_pages:
+            return 0.0
+        return self.skipped_pages * self.diff_time / self.diffed_pages
+
+
+class DaemonState(models.Model):
+    """State of the daemon kept across cycles, there is one row."""
+
+    sweep_started = models.DateTimeField(null=True) # see releases.sweep_if_due()
+    sweep_artist_id = models.IntegerField(default=0) # swept up to, 0 if done
+    refreshed = models.DateTimeField(null=True) # see releases.check()
+
+    @classmethod
+    def get(cls):
+        state, created = cls.objects.get_or_create(id=1)
+        return state
+
+
+class DeadJob(models.Model):
+    """Jobs which failed Job.MAX_ATTEMPTS times, see daemon/jobs.py."""
+
+    user = models.ForeignKey(User, null=True)
+    type = models.IntegerField()
+    data = models.TextField()
+    attempts = models.IntegerField()
+    error = models.TextField() # of the last attempt
+    failed = models.DateTimeField(auto_now_add=True)
+
+    def requeue(self):
+        with transaction.commit_on_success():
+            Job.add(self.user, self.type, self.data)
+            self.delete()
+
+
+class DumpArtist(models.Model):
+    """Artists loaded from the MusicBrainz data dumps, see daemon/dump.py."""
+
+    mbid = models.CharField(max_length=36, primary_key=True)
+    name = models.CharField(max_length=512)
+    sort_name = models.CharField(max_length=512)
+    disambiguation = models.CharField(max_length=512)
+
+
+class DumpFile(models.Model):
+    """Incremental dump files which were already applied."""
+
+    name = models.CharField(max_length=255, unique=True)
+    applied = models.DateTimeField()
+
+
+class DumpReleaseGroup(models.Model):
+    """Release groups from the dumps, one row per credited artist."""
+
+    class Meta:
+        unique_together = ('artist_mbid', 'mbid')
+
+    artist_mbid = models.CharField(max_length=36)
+    mbid = models.CharField(max_length=36, db_index=True)
+    name = models.CharField(max_length=512)
+    type = models.CharField(max_length=16)
+    date = models.IntegerField()
+
+
 class Job(models.Model):
 
     ADD_ARTIST = 1
     ADD_RELEASE_GROUPS = 2
     GET_COVER = 3
     IMPORT_LASTFM = 4
+    UPDATE_ARTIST = 5
+
+    # Lower runs first. A user is waiting for the urgent jobs.
+    URGENT = 0
+    PRIORITIES = {
+        ADD_ARTIST: URGENT,
+        ADD_RELEASE_GROUPS: URGENT,
+        GET_COVER: URGENT,
+        IMPORT_LASTFM: 1,
+        UPDATE_ARTIST: 2,
+        }
+    # Attempts before a failing job is moved to DeadJob.
+    MAX_ATTEMPTS = {
+        ADD_ARTIST: 5,
+        ADD_RELEASE_GROUPS: 10,
+        GET_COVER: 3,
+        IMPORT_LASTFM: 5,
+        UPDATE_ARTIST: 10,
+        }
+    # Requests for the same work are merged into one job, see add().
+    COALESCED = (ADD_RELEASE_GROUPS, GET_COVER, UPDATE_ARTIST)
 
     user = models.ForeignKey(User, null=True)
     type = models.IntegerField()
     data = models.TextField()
 
+    # Queue, see daemon/jobs.py
+    priority = models.IntegerField(default=0)
+    run_at = models.DateTimeField(auto_now_add=True)
+    lease_owner = models.CharField(max_length=64, default='')
+    lease_until = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0) # failed so far
+    error = models.TextField(default='') # of the last failed attempt
+    key = models.CharField(max_length=64, null=True, unique=True) # "<type>:<data>" of the coalesced jobs
+    coalesced = models.IntegerField(default=0) # requests merged into this job
+
+    @classmethod
+    def add(cls, user, type, data, priority=None):
+        """Queue a job, with the default priority of its type unless given.
+
+        If the same work is already queued or running, count the request
+        in that job instead and raise its priority if needed. A running
+        job runs again once done, see jobs.done().
+
+        """
+        if priority is None:
+            priority = cls.PRIORITIES[type]
+        key = '%d:%s' % (type, data) if type in cls.COALESCED else None
+        job = cls(user=user, type=type, data=data, priority=priority, key=key)
+        try:
+            job.save()
+        except IntegrityError:
+            cls.objects.filter(key=key).update(coalesced=F('coalesced') + 1)
+            cls.objects.filter(key=key, priority__gt=priority).update(priority=priority)
+
     @classmethod
-    def add_artists(cls, user, names):
+    def add_artists(cls, user, names, priority=None):
         with transaction.commit_on_success():
             for name in names:
-                cls(user=user, type=cls.ADD_ARTIST, data=name).save()
+                cls.add(user, cls.ADD_ARTIST, name, priority)
 
     @classmethod
-    def add_release_groups(cls, artist):
-        cls(user=None, type=cls.ADD_RELEASE_GROUPS, data=artist.mbid).save()
+    def add_release_groups(cls, artist, priority=None):
+        cls.add(None, cls.ADD_RELEASE_GROUPS, artist.mbid, priority)
 
     @classmethod
     def get_cover(cls, mbid):
-        cls(user=None, type=cls.GET_COVER, data=mbid).save()
+        cls.add(None, cls.GET_COVER, mbid)
 
     @classmethod
     def import_lastfm(cls, user, username, count, period):
         data = str(count) + ',' + period + ',' + username
-        cls(user=user, type=cls.IMPORT_LASTFM, data=data).save()
+        cls.add(user, cls.IMPORT_LASTFM, data)
+
+    @classmethod
+    def update_artist(cls, mbid):
+        cls.add(None, cls.UPDATE_ARTIST, mbid)
 
     @classmethod
     def importing_artists(cls, user):
@@ -206,11 +445,25 @@ class ReleaseGroup(models.Model):
     def date_iso8601(self):
         return date_to_iso8601(self.date)
 
+    def page_token(self):
+        """Return the token of the page following this release group."""
+        return encode_page_token((bool(getattr(self, 'is_starred', None)), self.date, self.id))
+
     @classmethod
-    def get(cls, artist=None, user=None, limit=0, offset=0, feed=False):
+    def get(cls, artist=None, user=None, limit=0, offset=0, feed=False, after=None):
+        """Return the release groups of the artist or of the user's artists.
+
+        The user's starred release groups come first, then the newest ones.
+        Page either with offset or, to avoid skipping the rows of the
+        previous pages, with after: the decoded page_token() of the last
+        release group of the previous page.
+
+        """
         if not artist and not user:
             assert 'Both artist and user are None'
             return None
+        if not artist:
+            return cls._get_timeline(user, limit, offset, feed, after)
 
         # Unfortunately I don't see how to use ORM for these queries.
         sql = """
@@ -261,14 +514,82 @@ LIMIT %s OFFSET %s
                 # TODO: Feel free to remove this check some time in 2013.
                 where += '\nAND "app_releasegroup"."id" > 261202'
 
+        order += ', "app_releasegroup"."id"'
+
+        if after:
+            starred, date, id = after
+            if user:
+                where += """
+AND (("app_star"."id" IS NOT NULL) < %s OR (("app_star"."id" IS NOT NULL) = %s AND (
+    "app_releasegroup"."date" < %s OR
+    ("app_releasegroup"."date" = %s AND "app_releasegroup"."id" > %s))))"""
+                params.extend([starred, starred, date, date, id])
+            else:
+                # The first condition lets SQLite seek the date index.
+                where += """
+AND "app_releasegroup"."date" <= %s AND (
+    "app_releasegroup"."date" < %s OR
+    ("app_releasegroup"."date" = %s AND "app_releasegroup"."id" > %s))"""
+                params.extend([date, date, date, id])
+
         sql = sql.format(select=select, join=join, where=where, order=order)
         params.extend([limit, offset])
         return cls.objects.raw(sql, params)
 
     @classmethod
-    def get_calendar(cls, date, limit, offset):
-        """Returns the list of release groups for the date."""
+    def _get_timeline(cls, user, limit, offset, feed, after):
+        """Return the release groups of the user's artists, see get()."""
+        sql = """
+SELECT
+    "app_releasegroup"."id",
+    "app_releasegroup"."artist_id",
+    "app_releasegroup"."mbid",
+    "app_releasegroup"."name",
+    "app_releasegroup"."type",
+    "app_releasegroup"."date",
+    "app_releasegroup"."is_deleted",
+    "app_artist"."mbid" AS "artist_mbid",
+    "app_artist"."name" AS "artist_name",
+    "app_artist"."sort_name" AS "artist_sort_name",
+    "app_artist"."disambiguation" AS "artist_disambiguation",
+    "app_timeline"."is_starred"
+FROM "app_timeline"
+JOIN "app_releasegroup" ON "app_releasegroup"."id" = "app_timeline"."release_group_id"
+JOIN "app_artist" ON "app_artist"."id" = "app_releasegroup"."artist_id"
+WHERE "app_timeline"."user_id" = %s
+{where}
+ORDER BY "app_timeline"."is_starred" DESC, "app_timeline"."date" DESC, "app_timeline"."release_group_id"
+LIMIT %s OFFSET %s
+"""
+        where = ''
+        params = [user.id]
+        if feed and user.get_profile().legacy_id:
+            # Don't include release groups added during the import
+            # TODO: Feel free to remove this check some time in 2013.
+            where += '\nAND "app_timeline"."release_group_id" > 261202'
+        if after:
+            starred, date, id = after
+            where += """
+AND ("app_timeline"."is_starred" < %s OR ("app_timeline"."is_starred" = %s AND (
+    "app_timeline"."date" < %s OR
+    ("app_timeline"."date" = %s AND "app_timeline"."release_group_id" > %s))))"""
+            params.extend([starred, starred, date, date, id])
+        sql = sql.format(where=where)
+        params.extend([limit, offset])
+        return cls.objects.raw(sql, params)
+
+    @classmethod
+    def get_calendar(cls, date, limit, offset, after=None):
+        """Returns the list of release groups for the date.
+
+        Page with offset or after, see get().
+
+        """
         q = cls.objects.filter(date__lte=date)
+        if after:
+            starred, after_date, after_id = after
+            q = q.filter(Q(date__lt=after_date) | Q(date=after_date, id__gt=after_id),
+                         date__lte=after_date)
         q = q.select_related('artist')
         # Calendar uses the same template as releases, adapt to conform.
         q = q.extra(select={
@@ -278,7 +599,7 @@ LIMIT %s OFFSET %s
                 'artist_disambiguation': '"app_artist"."disambiguation"',
                 })
         q = q.filter(is_deleted=False)
-        q = q.order_by('-date')
+        q = q.order_by('-date', 'id')
         return q[offset:offset+limit]
 
 
@@ -301,6 +622,107 @@ class Star(models.Model):
             cls.objects.get_or_create(user=user, release_group=release_group)
         else:
             cls.objects.filter(user=user, release_group=release_group).delete()
+        Timeline.refill(user_id=user.id, ids=[release_group.id])
+
+
+class Timeline(models.Model):
+    """The release groups shown to a user, see ReleaseGroup.get().
+
+    A denormalized copy of the release groups of the user's artists which
+    are not deleted and have one of the user's types, sorted like the
+    pages. Whatever changes these must refill() the affected rows, the
+    timeline command finds and fixes the rows which were missed.
+
+    """
+    class Meta:
+        unique_together = ('release_group', 'user')
+
+    user = models.ForeignKey(User)
+    release_group = models.ForeignKey(ReleaseGroup)
+    date = models.IntegerField() # same as release_group.date
+    is_starred = models.BooleanField()
+
+    @classmethod
+    def refill(cls, user_id=None, artist_id=None, ids=None):
+        """Recompute the rows of the user, the artist and the release groups.
+
+        Any combination narrows the rows down, with no arguments all rows
+        are recomputed. Return the number of rows inserted.
+
+        Call it inside the transaction which writes the release groups or
+        the follows, so that they can't get out of sync.
+
+        """
+        delete, fill, params = [], [], []
+        if user_id is not None:
+            delete.append('"user_id" = %s')
+            fill.append('"app_userartist"."user_id" = %s')
+            params.append(user_id)
+        if artist_id is not None:
+            delete.append('"release_group_id" IN '
+                          '(SELECT "id" FROM "app_releasegroup" WHERE "artist_id" = %s)')
+            fill.append('"app_releasegroup"."artist_id" = %s')
+            params.append(artist_id)
+        if ids is not None:
+            if not ids:
+                return 0
+            ss = ', '.join(['%s'] * len(ids))
+            delete.append('"release_group_id" IN (%s)' % ss)
+            fill.append('"app_releasegroup"."id" IN (%s)' % ss)
+            params.extend(ids)
+
+        if transaction.is_managed():
+            # A nested commit_on_success() would commit the caller's transaction.
+            return cls._fill(delete, fill, params)
+        with transaction.commit_on_success():
+            return cls._fill(delete, fill, params)
+
+    @classmethod
+    def _fill(cls, delete, fill, params):
+        cursor = connection.cursor()
+        cursor.execute(
+            'DELETE FROM "app_timeline" WHERE ' + (' AND '.join(delete) or '1'), params)
+        cursor.execute(
+            """
+            INSERT INTO "app_timeline" ("user_id", "release_group_id", "date", "is_starred")
+            """ + cls._select(' AND '.join(fill) or '1'), params)
+        return cursor.rowcount
+
+    @classmethod
+    def check(cls):
+        """Return the ids of the users whose rows are missing or stale."""
+        expected = cls._select('1')
+        actual = """
+            SELECT "user_id", "release_group_id", "date", "is_starred" FROM "app_timeline"
+            """
+        user_ids = set()
+        cursor = connection.cursor()
+        for a, b in ((expected, actual), (actual, expected)):
+            cursor.execute('SELECT DISTINCT "user_id" FROM (%s EXCEPT %s)' % (a, b))
+            user_ids.update(row[0] for row in cursor.fetchall())
+        return sorted(user_ids)
+
+    @classmethod
+    def _select(cls, where):
+        """Return the SQL selecting the rows which should be in the timeline."""
+        wanted = ' '.join("WHEN '%s' THEN \"app_userprofile\".\"%s\"" % (type, field)
+                          for field, types in UserProfile.TYPES for type in types)
+        return """
+            SELECT
+                "app_userartist"."user_id",
+                "app_releasegroup"."id",
+                "app_releasegroup"."date",
+                EXISTS (
+                    SELECT 1 FROM "app_star"
+                    WHERE "app_star"."user_id" = "app_userartist"."user_id"
+                    AND "app_star"."release_group_id" = "app_releasegroup"."id")
+            FROM "app_releasegroup"
+            JOIN "app_userartist" ON "app_userartist"."artist_id" = "app_releasegroup"."artist_id"
+            JOIN "app_userprofile" ON "app_userprofile"."user_id" = "app_userartist"."user_id"
+            WHERE NOT "app_releasegroup"."is_deleted"
+            AND (CASE "app_releasegroup"."type" %s ELSE 0 END)
+            AND %s
+            """ % (wanted, where)
 
 
 class UserArtist(models.Model):
@@ -321,19 +743,50 @@ class UserArtist(models.Model):
 
     @classmethod
     def add(cls, user, artist):
-        user_artist = cls(user=user, artist=artist)
-        try:
-            user_artist.save()
-        except IntegrityError:
-            pass
+        with transaction.commit_on_success():
+            user_artist = cls(user=user, artist=artist)
+            try:
+                user_artist.save()
+            except IntegrityError:
+                return
+            # Orphaned artists are rarely checked, refresh this one first.
+            Artist.objects.filter(id=artist.id, followers=0).update(next_check=None)
+            Artist.objects.filter(id=artist.id).update(followers=F('followers') + 1)
+            Timeline.refill(user_id=user.id, artist_id=artist.id)
+
+    @classmethod
+    def add_many(cls, user, artists):
+        """Follow the artists in one transaction, return the number of new follows."""
+        ids = set(artist.id for artist in artists)
+        ids -= set(cls.objects.filter(user=user, artist__in=ids).values_list('artist', flat=True))
+        if not ids:
+            return 0
+        with transaction.commit_on_success():
+            for artist_id in list(ids):
+                try:
+                    cls(user=user, artist_id=artist_id).save()
+                except IntegrityError:
+                    # Followed meanwhile.
+                    ids.remove(artist_id)
+            q = Artist.objects.filter(id__in=ids)
+            q.filter(followers=0).update(next_check=None)
+            q.update(followers=F('followers') + 1)
+            Timeline.refill(user_id=user.id)
+        return len(ids)
 
     @classmethod
     def remove(cls, user, mbids):
+        artist_ids = []
         with transaction.commit_on_success():
             for mbid in mbids:
                 q = cls.objects.filter(user=user)
                 q = q.filter(artist__mbid=mbid)
+                artist_ids.extend(q.values_list('artist', flat=True))
+                artists = Artist.objects.filter(id__in=q.values('artist'))
+                artists.update(followers=F('followers') - 1)
                 q.delete()
+            for artist_id in artist_ids:
+                Timeline.refill(user_id=user.id, artist_id=artist_id)
 
 
 class UserProfile(models.Model):
@@ -355,17 +808,23 @@ class UserProfile(models.Model):
     reset_code = models.CharField(max_length=code_length)
     legacy_id = models.IntegerField(null=True)
 
+    # The release types enabled by each field.
+    TYPES = [
+        ('notify_album', ['Album']),
+        ('notify_single', ['Single']),
+        ('notify_ep', ['EP']),
+        ('notify_live', ['Live']),
+        ('notify_compilation', ['Compilation']),
+        ('notify_remix', ['Remix']),
+        ('notify_other', ['Soundtrack', 'Spokenword', 'Interview', 'Audiobook', 'Other']),
+        ]
+
     def get_types(self):
         """Return the list of release types the user wants to follow."""
         types = []
-        if self.notify_album: types.append('Album')
-        if self.notify_single: types.append('Single')
-        if self.notify_ep: types.append('EP')
-        if self.notify_live: types.append('Live')
-        if self.notify_compilation: types.append('Compilation')
-        if self.notify_remix: types.append('Remix')
-        if self.notify_other:
-            types.extend(['Soundtrack', 'Spokenword', 'Interview', 'Audiobook', 'Other'])
+        for field, field_types in self.TYPES:
+            if getattr(self, field):
+                types.extend(field_types)
         return types
 
     def generate_code(self):
@@ -376,9 +835,14 @@ class UserProfile(models.Model):
         user = self.user
         with transaction.commit_on_success():
             Job.objects.filter(user=user).delete()
+            DeadJob.objects.filter(user=user).delete()
             Notification.objects.filter(user=user).delete()
             Star.objects.filter(user=user).delete()
-            UserArtist.objects.filter(user=user).delete()
+            Timeline.objects.filter(user=user).delete()
+            q = UserArtist.objects.filter(user=user)
+            artists = Artist.objects.filter(id__in=q.values('artist'))
+            artists.update(followers=F('followers') - 1)
+            q.delete()
             UserSearch.objects.filter(user=user).delete()
             self.delete()
             # Cannot call user.delete() because it references deprecated auth_message.
@@ -15,12 +15,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with muspy.  If not, see <http://www.gnu.org/licenses/>.
 
-from socket import setdefaulttimeout
-from urllib import urlencode
-from urllib2 import HTTPError, Request, urlopen
-from xml.etree import ElementTree as et
+from urllib2 import HTTPError
+from xml.etree import cElementTree as et
 
-setdefaulttimeout(10)
+from settings import MUSICBRAINZ_URL
+
+from app import client, ratelimit
+from app.cache import Cache
+from app.tools import iterparse
+
+# Responses are cached for this many seconds.
+TTL_SEARCH = 60 * 60
+TTL_LOOKUP = 24 * 60 * 60
+TTL_BROWSE = 60 * 60
+TTL_NOT_FOUND = 60 * 60
+
+_cache = Cache('musicbrainz')
 
 def search_artists(query, limit, offset):
     # Escape Lucene special characters.
@@ -28,27 +38,59 @@ def search_artists(query, limit, offset):
     for c in special:
         query = query.replace(c, '\\' + c)
     try:
-        xml = _fetch('artist', query=query, limit=limit, offset=offset)
+        chunks = _fetch('artist', query=query, limit=limit, offset=offset)
+        items = iterparse(chunks)
+        ns = _namespace(next(items))
+        artist_list = next(items)
+        if artist_list.tag != ns + 'artist-list':
+            return [], 0
+        count = int(artist_list.get('count'))
+        artists = [_parse_artist(element, ns) for element in items]
+    except StopIteration:
+        return [], 0
     except:
         return None, 0
+    return artists, count
 
-    root, ns = _parse_root(xml)
-    if root is None:
-        return [], 0
+def get_artists(mbids):
+    """Look up to 100 artists with one search, return {mbid: artist}.
 
-    artist_list = root.find('%sartist-list' % ns)
-    if artist_list is None:
-        return [], 0
+    Merged and deleted artists are not returned. Return None on errors.
 
-    count = int(artist_list.get('count'))
-    artists = [_parse_artist(element, ns) 
-               for element 
-               in root.findall('%sartist-list/%sartist' % (ns, ns))]
-    return artists, count
+    """
+    query = 'arid:(%s)' % ' OR '.join(mbids)
+    try:
+        chunks = _fetch('artist', query=query, limit=len(mbids), offset=0)
+        artists = list(_iter_list(chunks, 'artist-list', _parse_artist))
+    except:
+        return None
+    return dict((artist['id'], artist) for artist in artists)
+
+def search_release_groups(query, limit, offset):
+    """Search release groups with a Lucene query, return (release_groups, count).
+
+    Unlike search_artists(), the query is not escaped. Each release
+    group has the mbids of its credited artists in 'artists'.
+
+    """
+    try:
+        chunks = _fetch('release-group', query=query, limit=limit, offset=offset)
+        items = iterparse(chunks)
+        ns = _namespace(next(items))
+        release_group_list = next(items)
+        if release_group_list.tag != ns + 'release-group-list':
+            return [], 0
+        count = int(release_group_list.get('count'))
+        release_groups = [_parse_release_group(element, ns) for element in items]
+    except StopIteration:
+        return [], 0
+    except:
+        return None, 0
+    return release_groups, count
 
 def get_artist(mbid):
     try:
-        xml = _fetch('artist', mbid=mbid)
+        xml = ''.join(_fetch('artist', mbid=mbid))
     except HTTPError as e:
         if e.code == 404:
             return []
@@ -63,60 +105,93 @@ def get_artist(mbid):
     return _parse_artist(root.find('%sartist' % ns), ns)
 
 def get_release_groups(mbid, limit, offset=0):
+    """Download and parse a page of release groups, return None on errors.
+
+    The response is parsed while it downloads, but the whole page is
+    read before returning: write it to the database only then, a
+    transaction open during the download would hold the SQLite write
+    lock for the length of the request.
+
+    """
     try:
-        xml = _fetch('release-group', artist=mbid, limit=limit, offset=offset)
+        chunks = _fetch('release-group', artist=mbid, limit=limit, offset=offset)
+        return list(_iter_list(chunks, 'release-group-list', _parse_release_group))
     except HTTPError as e:
         if e.code == 404:
             return []
         return None
+    except SyntaxError:
+        # Malformed XML.
+        return []
     except:
         return None
 
-    root, ns = _parse_root(xml)
-    if root is None or ns is None:
-        return []
-
-    return [_parse_release_group(element, ns)
-            for element
-            in root.findall('%srelease-group-list/%srelease-group' % (ns, ns))]
-
 def get_releases(mbid, limit, offset=0):
     try:
         kw = {'release-group': mbid, 'limit': limit, 'offset': offset}
-        xml = _fetch('release', **kw)
+        chunks = _fetch('release', **kw)
+        return list(_iter_list(chunks, 'release-list', _parse_release))
     except:
         return None
 
-    root, ns = _parse_root(xml)
-    if root is None or ns is None:
-        return []
+def _fetch(resource, mbid=None, **kw):
+    """Request a resource, return an iterable of response chunks.
 
-    return [_parse_release(element, ns)
-            for element
-            in root.findall('%srelease-list/%srelease' % (ns, ns))]
+    The request is sent immediately, HTTP errors are raised here. The
+    response is cached once it is read in full.
 
-def _fetch(resource, mbid=None, **kw):
-    url = 'http://musicbrainz.org/ws/2/'
+    """
+    url = MUSICBRAINZ_URL + '/ws/2/'
     url += resource + '/'
     if mbid: 
         url += mbid
-    url += '?' + _urlencode(kw)
-
-    request = Request(url, headers = {'User-Agent': 'muspy/2.0'})
-    response = urlopen(request)
-    return response.read()
+    url += '?' + client.urlencode(sorted(kw.items()))
+
+    found, xml = _cache.get(url)
+    if found:
+        if xml is None:
+            raise HTTPError(url, 404, 'Not Found', None, None)
+        return [xml]
+
+    if 'query' in kw:
+        ttl = TTL_SEARCH
+    elif mbid:
+        ttl = TTL_LOOKUP
+    else:
+        ttl = TTL_BROWSE
+    try:
+        response = ratelimit.musicbrainz.get(url)
+    except HTTPError as e:
+        if e.code == 404:
+            _cache.set(url, None, TTL_NOT_FOUND)
+        raise
+    return _cache_chunks(url, response, ttl)
+
+def _cache_chunks(url, chunks, ttl):
+    received = []
+    for chunk in chunks:
+        received.append(chunk)
+        yield chunk
+    _cache.set(url, ''.join(received), ttl)
+
+def _iter_list(chunks, list_tag, parse):
+    items = iterparse(chunks)
+    try:
+        ns = _namespace(next(items))
+        if next(items).tag != ns + list_tag:
+            return
+    except StopIteration:
+        return
+    for element in items:
+        yield parse(element, ns)
 
-def _urlencode(params):
-    if isinstance(params, dict):
-        params = params.items()
-    return urlencode([(k, v.encode('utf-8') if isinstance(v, unicode) else v)
-                      for k, v in params])
+def _namespace(root):
+    return root.tag[:root.tag.find('metadata')]
 
 def _parse_root(xml):
     try:
         root = et.fromstring(xml)
-        ns = root.tag[:root.tag.find('metadata')]
-        return root, ns
+        return root, _namespace(root)
     except:
         return None, None
 
@@ -138,6 +213,10 @@ def _parse_release_group(element, ns):
     d['type'] = element.get('type')
     for prop in element:
         d[prop.tag[len(ns):]] = prop.text
+    credit = element.find(ns + 'artist-credit')
+    if credit is not None:
+        path = '%sname-credit/%sartist' % (ns, ns)
+        d['artists'] = [artist.get('id').lower() for artist in credit.findall(path)]
     return d
 
 def _parse_release(element, ns):
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rate limiting shared by the web workers and the daemon.
+
+Each web service has a token bucket, its state is kept in a small file
+and updated under an exclusive lock, so that all processes draw from
+the same budget.
+
+The rate adapts to the responses, see Bucket.
+
+Requests have a priority. A few tokens are reserved for interactive
+requests (a user waiting for a page), background requests (the daemon)
+only get the tokens above the reserve. When there is no interactive
+traffic, the background requests use the whole budget. Interactive
+requests fail with Unavailable rather than keep the user waiting.
+
+"""
+
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
+import errno
+import fcntl
+from httplib import HTTPException
+import json
+import logging
+import os
+import threading
+import time
+from urllib2 import HTTPError
+
+from app import client
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_default_priority = INTERACTIVE
+_local = threading.local()
+
+
+def get_priority():
+    return getattr(_local, 'priority', _default_priority)
+
+def set_default_priority(priority):
+    """Set the priority of requests sent by this process."""
+    global _default_priority
+    _default_priority = priority
+
+@contextmanager
+def priority(value):
+    """Send requests made inside the with block with this priority."""
+    old = getattr(_local, 'priority', None)
+    _local.priority = value
+    try:
+        yield
+    finally:
+        if old is None:
+            del _local.priority
+        else:
+            _local.priority = old
+
+
+class Unavailable(IOError):
+    """An interactive request would wait longer than Bucket.MAX_WAIT."""
+
+
+class Bucket(object):
+    """Token bucket with an adaptive rate.
+
+    The rate is adjusted using AIMD: it is halved each time the service
+    says it's overloaded (HTTP 503, a 5xx error or a network error) and
+    increases by a small step with each successful request, up to
+    max_rate. If the service sends Retry-After, nobody sends requests
+    until then.
+
+    """
+    DECREASE = 0.5
+    INCREASE = 0.02 # of max_rate, per successful request
+    MAX_PAUSE = 300 # seconds
+    MAX_WAIT = 5 # seconds, for interactive requests
+
+    def __init__(self, name, rate, burst, reserve, max_rate=None):
+        base = os.path.abspath(os.path.dirname(__file__) + '/..')
+        self._path = os.path.join(base, 'cache', name + '.bucket')
+        self.name = name
+        self.rate = rate # initial tokens per second
+        self.max_rate = max_rate or rate
+        self.min_rate = self.max_rate / 20
+        self.burst = burst # bucket size
+        self.reserve = reserve # tokens only interactive requests can take
+
+    def get(self, url):
+        """Send a GET request within the budget, adapt the rate to the response."""
+        self.acquire()
+        try:
+            response = client.get(url)
+        except HTTPError as e:
+            if e.code == 503 or e.code == 429:
+                self.throttled(_retry_after(e.headers))
+            elif e.code >= 500:
+                self.throttled()
+            else:
+                self.succeeded()
+            raise
+        except (IOError, HTTPException):
+            self.throttled()
+            raise
+        self.succeeded()
+        return response
+
+    def acquire(self, priority=None):
+        """Block until a request can be sent, take a token.
+
+        A user is waiting for an interactive request, raise Unavailable
+        instead of blocking for longer than MAX_WAIT.
+
+        """
+        if priority is None:
+            priority = get_priority()
+        floor = self.reserve if priority == BACKGROUND else 0
+        deadline = time.time() + self.MAX_WAIT
+        while True:
+            with self._state() as state:
+                now = time.time()
+                rate = state.get('rate', self.rate)
+                tokens = state.get('tokens', self.burst)
+                tokens += (now - state.get('time', now)) * rate
+                tokens = min(self.burst, tokens)
+                state['time'] = now
+                pause = state.get('until', 0) - now
+                if pause <= 0 and tokens >= floor + 1:
+                    state['tokens'] = tokens - 1
+                    return
+                state['tokens'] = tokens
+                wait = max(pause, (floor + 1 - tokens) / rate)
+            if priority == INTERACTIVE and time.time() + wait > deadline:
+                raise Unavailable('%s is busy for %ds' % (self.name, wait))
+            time.sleep(wait)
+
+    def current_rate(self):
+        """Return the effective rate in requests per second."""
+        with self._state() as state:
+            return state.get('rate', self.rate)
+
+    def throttled(self, retry_after=None):
+        with self._state() as state:
+            now = time.time()
+            rate = state.get('rate', self.rate)
+            # Requests sent at the same time fail together, count them once.
+            if now - state.get('decreased', 0) > 1 / rate:
+                state['rate'] = max(self.min_rate, rate * self.DECREASE)
+                state['decreased'] = now
+            if retry_after:
+                pause = min(retry_after, self.MAX_PAUSE)
+                state['until'] = max(state.get('until', 0), now + pause)
+            rate = state.get('rate', self.rate)
+        logging.warning('[%s] Throttled, rate %.3f/s' % (self.name, rate))
+
+    def succeeded(self):
+        with self._state() as state:
+            rate = state.get('rate', self.rate)
+            if rate < self.max_rate:
+                state['rate'] = min(self.max_rate, rate + self.INCREASE * self.max_rate)
+
+    @contextmanager
+    def _state(self):
+        """Lock the state file, yield the state as a dict and save it."""
+        dirname = os.path.dirname(self._path)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _retry_after(headers):
+    """Parse the Retry-After header, return the number of seconds or None."""
+    value = headers.get('retry-after') if headers else None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+
+# MusicBrainz allows one request per second on average.
+musicbrainz = Bucket('musicbrainz', rate=1.0, burst=3, reserve=2)
+# Last.fm allows five requests per second averaged over five minutes.
+lastfm = Bucket('lastfm', rate=4.0, burst=10, reserve=5, max_rate=5.0)
@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with muspy.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import unicodedata
+from xml.etree import cElementTree as et
+
 def arrange_for_table(items, columns):
     """Prepare a list of items to show it in a table.
 
@@ -86,6 +90,24 @@ def date_to_iso8601(date):
     day = date % 100
     return "%04d-%02d-%02dT00:00:00Z" % (year, month or 1, day or 1)
 
+def normalize_name(name):
+    """Fold the case, the spacing and the Unicode forms of an artist name."""
+    return u' '.join(unicodedata.normalize('NFKC', unicode(name)).lower().split())
+
+def encode_page_token(key):
+    """Make an opaque page token of a tuple of ints, see ReleaseGroup.get()."""
+    token = '.'.join(str(int(value)) for value in key)
+    return base64.urlsafe_b64encode(token).rstrip('=')
+
+def decode_page_token(token, length=3):
+    """Reverse of encode_page_token(), return None if the token is invalid."""
+    try:
+        token = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+        key = tuple(int(value) for value in token.split('.'))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    return key if len(key) == length else None
+
 def check_password(user, password):
     # Legacy users have their passwords hashed with SHA512.
     # TODO: Remove when Django supports SHA512 (1.4?)
@@ -101,3 +123,44 @@ def check_password(user, password):
         hexdigest = hash.hexdigest()
         return constant_time_compare(hsh, hexdigest)
     return user.check_password(password)
+
+def iterparse(chunks):
+    """Parse an XML document incrementally, as its chunks arrive.
+
+    Web service responses look like <root><list><item/>...</list></root>.
+    Yield the root and the list elements as soon as their start tags are
+    parsed, only their attributes are available at this point. Then yield
+    each item once it is parsed in full, the item is discarded as soon as
+    the caller asks for the next one.
+
+    """
+    stack = []
+    for event, element in et.iterparse(_ChunkReader(chunks), ('start', 'end')):
+        if event == 'start':
+            if len(stack) < 2:
+                yield element
+            stack.append(element)
+            continue
+        stack.pop()
+        if len(stack) == 2:
+            yield element
+            stack[1].remove(element)
+
+class _ChunkReader(object):
+    """File-like object reading from an iterable of strings."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
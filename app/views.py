@@ -34,7 +34,7 @@ from app.cover import Cover
 from app.forms import *
 from app.models import *
 import app.musicbrainz as mb
-from app.tools import arrange_for_table, str_to_date, date_to_str
+from app.tools import arrange_for_table, decode_page_token, str_to_date, date_to_str
 
 def activate(request):
     if 'code' in request.GET:
@@ -66,25 +66,25 @@ def artist(request, mbid):
 
     PER_PAGE = 10
     try:
-        offset = int(request.GET.get('offset', 0))
+        offset, after = _get_page(request)
     except ValueError:
         return HttpResponseNotFound()
     user_has_artist = request.user.is_authenticated() and UserArtist.get(request.user, artist)
     if user_has_artist:
         show_stars = True
         release_groups = ReleaseGroup.get(
-            artist=artist, user=request.user, limit=PER_PAGE, offset=offset)
+            artist=artist, user=request.user, limit=PER_PAGE, offset=offset, after=after)
     else:
         show_stars = False
         release_groups = ReleaseGroup.get(
-            artist=artist, limit=PER_PAGE, offset=offset)
+            artist=artist, limit=PER_PAGE, offset=offset, after=after)
 
     release_groups = list(release_groups)
-    offset = offset + PER_PAGE if len(release_groups) == PER_PAGE else None
+    after = release_groups[-1].page_token() if len(release_groups) == PER_PAGE else None
     return render(request, 'artist.html', {
             'artist': artist,
             'release_groups': release_groups,
-            'offset': offset,
+            'after': after,
             'PER_PAGE': PER_PAGE,
             'user_has_artist': user_has_artist,
             'show_stars': show_stars})
@@ -145,6 +145,10 @@ def artists(request):
         first_is_exact = (len(found_artists) > 1 and
                           found_artists[0]['name'].lower() == search.lower() and
                           found_artists[1]['name'].lower() != search.lower())
+        if not offset and found_artists:
+            # Let the batch adds resolve this name without searching.
+            resolved = only_one or first_is_exact
+            ArtistName.found(search, found_artists[0]['id'] if resolved else '')
         if not dontadd and not offset and (only_one or first_is_exact):
             # Only one artist found - add it right away.
             artist_data = found_artists[0]
@@ -362,13 +366,17 @@ def index(request):
 def releases(request):
     PER_PAGE = 10
     limit = PER_PAGE + 1
-    offset = int(request.GET.get('offset', 0))
-    release_groups = list(ReleaseGroup.get(user=request.user, limit=limit, offset=offset))
-    offset = offset + PER_PAGE if len(release_groups) > PER_PAGE else None
+    try:
+        offset, after = _get_page(request)
+    except ValueError:
+        return HttpResponseNotFound()
+    release_groups = list(ReleaseGroup.get(
+            user=request.user, limit=limit, offset=offset, after=after))
+    after = release_groups[PER_PAGE - 1].page_token() if len(release_groups) > PER_PAGE else None
 
     return render(request, 'releases.html', {
             'release_groups': release_groups[:PER_PAGE],
-            'offset': offset,
+            'after': after,
             'PER_PAGE': PER_PAGE,
             'next': next,
             'show_stars': True})
@@ -468,3 +476,17 @@ def unsubscribe(request):
         request, 'You have successfully unsubscribed from release notifications. '
         'If you change your mind, you can subscribe to notifications on the Settings page.')
     return redirect('/')
+
+def _get_page(request):
+    """Return (offset, after) of the requested page, raise ValueError if invalid.
+
+    Old links use offset, new ones the after token, see ReleaseGroup.get().
+
+    """
+    offset = int(request.GET.get('offset', 0))
+    after = request.GET.get('after')
+    if after is not None:
+        after = decode_page_token(after)
+        if after is None:
+            raise ValueError('Invalid page token')
+    return offset, after
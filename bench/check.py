@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Measure the release checker throughput with several workers.
+
+Usage: python -m bench.check [artists [rate [rtt_ms [max_workers]]]]
+
+Each run checks the same artists on a fresh database against the local
+stub server, with 1, 2, 4... workers sharing a budget of rate requests
+per second. The database already has the release groups served by the
+stub, so the runs measure the steady state where few artists change.
+The throughput should grow with the workers until the rate limit
+becomes the bottleneck. The defaults are 200 artists, 40 requests/s and
+a 50ms round trip.
+
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+import settings
+
+from bench.stub import TYPES, Server, fake_mbid
+
+RELEASE_GROUPS = 50 # per artist
+
+
+def setup(tmp, server, rate):
+    """Point the database, the cache and the rate limit to tmp."""
+    settings.MUSICBRAINZ_URL = server.url
+    from app import ratelimit
+    import app.musicbrainz as mb
+
+    settings.DATABASES['default']['NAME'] = os.path.join(tmp, 'muspy.db')
+    mb._cache._root = os.path.join(tmp, 'cache')
+    bucket = ratelimit.musicbrainz
+    bucket._path = os.path.join(tmp, 'musicbrainz.bucket')
+    bucket.rate = bucket.max_rate = rate
+    bucket.min_rate = rate / 20
+    bucket.burst = bucket.reserve + 1
+
+def run(tmp, server, artists, workers):
+    from django.db import connection
+    from daemon import releases
+
+    # A fresh database, cache and budget for each run.
+    connection.close()
+    for name in ('muspy.db', 'musicbrainz.bucket', 'cache'):
+        path = os.path.join(tmp, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    db = sqlite3.connect(settings.DATABASES['default']['NAME'])
+    schema = os.path.join(os.path.dirname(__file__), '..', 'db', 'muspy.sql')
+    db.executescript(open(schema).read())
+    for i in xrange(artists):
+        mbid = fake_mbid('artist', i)
+        name = 'Artist %s' % mbid[:8]
+        cursor = db.execute(
+            'INSERT INTO "app_artist" ("mbid", "name", "sort_name", "disambiguation") '
+            'VALUES (?, ?, ?, ?)', (mbid, name, name, ''))
+        # The same release groups as bench.stub.release_groups_xml().
+        db.executemany(
+            'INSERT INTO "app_releasegroup" '
+            '("artist_id", "mbid", "name", "type", "date", "is_deleted") '
+            'VALUES (?, ?, ?, ?, ?, 0)',
+            [(cursor.lastrowid, fake_mbid(mbid, j),
+              'Release group %d of %s' % (j, mbid), TYPES[j % len(TYPES)],
+              (1970 + j % 45) * 10000 + (1 + j % 12) * 100 + 1 + j % 28)
+             for j in xrange(RELEASE_GROUPS)])
+    db.commit()
+    db.close()
+
+    server.reset()
+    start = time.time()
+    checked = releases.check(workers).checked_artists
+    elapsed = time.time() - start
+    return checked, elapsed, server.requests
+
+def main():
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 40.0
+    rtt = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+    max_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    logging.basicConfig(level=logging.ERROR)
+
+    server = Server(release_groups=RELEASE_GROUPS, rtt=rtt).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        setup(tmp, server, rate)
+        workers = 1
+        while workers <= max_workers:
+            checked, elapsed, requests = run(tmp, server, artists, workers)
+            sys.stdout.write(
+                '%2d workers %8.1f artists/s %8.1f requests/s (limit %.1f)\n' % (
+                    workers, checked / elapsed, requests / elapsed, rate))
+            workers *= 2
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare urllib2 with app.client against the local stub server.
+
+Usage: python -m bench.client [requests [rtt_ms [bandwidth_kbps]]]
+
+The defaults simulate a 20ms round trip and a 8 Mbit/s link.
+
+"""
+
+import sys
+import time
+from urllib2 import Request, urlopen
+
+from app import client
+from bench.stub import Server
+
+
+def run(fetch, server, n):
+    server.reset()
+    start = time.time()
+    for i in xrange(n):
+        url = server.url + '/ws/2/release-group/?artist=%d&limit=100&offset=0' % i
+        fetch(url)
+    elapsed = time.time() - start
+    return {
+        'latency_ms': 1000.0 * elapsed / n,
+        'bytes_per_request': server.bytes_sent // n,
+        'connections': server.connections,
+        }
+
+def fetch_urllib2(url):
+    return urlopen(Request(url, headers={'User-Agent': 'muspy/2.0'})).read()
+
+def fetch_client(url):
+    return client.get(url).read()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rtt = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    bandwidth = float(sys.argv[3]) * 1000 / 8 if len(sys.argv) > 3 else 1e6
+    server = Server(rtt=rtt, bandwidth=bandwidth).start()
+    # Warm up.
+    fetch_urllib2(server.url + '/ws/2/release-group/?artist=0')
+    fetch_client(server.url + '/ws/2/release-group/?artist=0')
+    for name, fetch in (('urllib2', fetch_urllib2), ('client', fetch_client)):
+        r = run(fetch, server, n)
+        sys.stdout.write(
+            '%-8s %8.3f ms/request %8d bytes/request %6d new connections\n' % (
+                name, r['latency_ms'], r['bytes_per_request'], r['connections']))
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
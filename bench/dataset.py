@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fill a database with a synthetic dataset for the query benchmarks.
+
+Usage: python -m bench.dataset path [scale]
+
+At scale 1 (the default) there are 100k users, 500k artists and about
+20M release groups, smaller scales shrink everything proportionally.
+Followers are skewed, a few artists are followed by many users and most
+by a handful, users follow 50 artists on average and star a few of
+their release groups. The data is the same for the same scale.
+
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+import settings
+
+from bench.stub import fake_mbid
+
+USERS = 100000
+ARTISTS = 500000
+RELEASE_GROUPS = 40 # per artist, on average
+FOLLOWS = 50 # per user, on average
+STARS = 5 # per user, on average
+TYPES = ['Album'] * 8 + ['Single'] * 6 + ['EP'] * 3 + ['Live', 'Compilation', 'Remix', 'Other']
+BATCH_SIZE = 10000
+
+
+def create(path, scale=1.0):
+    """Create the database at path, return the number of rows per table."""
+    base = os.path.abspath(os.path.dirname(__file__) + '/..')
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    with open(os.path.join(base, 'db', 'muspy.sql')) as f:
+        db.executescript(f.read())
+    db.execute('PRAGMA synchronous = OFF')
+
+    rnd = random.Random(scale)
+    users = max(1, int(USERS * scale))
+    artists = max(1, int(ARTISTS * scale))
+    today = int(time.strftime('%Y%m%d'))
+    counts = {}
+
+    def insert(table, columns, rows):
+        sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+            table, ', '.join('"%s"' % c for c in columns), ', '.join('?' * len(columns)))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                db.executemany(sql, batch)
+                batch = []
+        db.executemany(sql, batch)
+        counts[table] = db.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+
+    insert('auth_user',
+           ['id', 'username', 'first_name', 'last_name', 'email', 'password', 'is_staff',
+            'is_active', 'is_superuser', 'last_login', 'date_joined'],
+           ((i, 'user%d' % i, '', '', 'user%d@example.com' % i, '', 0, 1, 0,
+             '2012-01-01 00:00:00', '2012-01-01 00:00:00') for i in xrange(1, users + 1)))
+    insert('app_userprofile',
+           ['user_id', 'notify', 'notify_album', 'notify_single', 'notify_ep', 'notify_live',
+            'notify_compilation', 'notify_remix', 'notify_other', 'email_activated',
+            'activation_code', 'reset_code'],
+           ((i, 1, 1, 1, 1, rnd.random() < 0.5, rnd.random() < 0.5, rnd.random() < 0.5,
+             rnd.random() < 0.2, 1, '', '') for i in xrange(1, users + 1)))
+
+    # Release groups of artist i are ids first[i] .. first[i] + count[i] - 1.
+    first, count = [0], [0]
+    for i in xrange(artists):
+        first.append(first[-1] + count[-1])
+        count.append(min(1000, int(rnd.expovariate(1.0 / RELEASE_GROUPS))))
+    insert('app_artist',
+           ['id', 'mbid', 'name', 'sort_name', 'disambiguation'],
+           ((i, fake_mbid('artist', i), 'Artist %d' % i, 'Artist %07d' % i, '')
+            for i in xrange(1, artists + 1)))
+
+    def release_groups():
+        for i in xrange(1, artists + 1):
+            for j in xrange(count[i]):
+                year = rnd.randint(1960, today // 10000)
+                month = rnd.randint(0, 12)
+                day = rnd.randint(0, 28) if month else 0
+                date = year * 10000 + month * 100 + day
+                yield (first[i] + j + 1, i, fake_mbid('release-group', i, j),
+                       'Release group %d of artist %d' % (j, i), rnd.choice(TYPES),
+                       min(date, today + 600), rnd.random() < 0.01)
+    insert('app_releasegroup',
+           ['id', 'artist_id', 'mbid', 'name', 'type', 'date', 'is_deleted'],
+           release_groups())
+
+    # Zipf-like popularity: artist k is followed about 1/k as often as the first.
+    def popular_artist():
+        return min(artists, int(artists ** rnd.random()))
+
+    follows = {}
+    def user_artists():
+        for u in xrange(1, users + 1):
+            n = min(artists, int(rnd.expovariate(1.0 / FOLLOWS)) + 1)
+            followed = set()
+            while len(followed) < n:
+                followed.add(popular_artist())
+            follows[u] = list(followed)
+            for a in followed:
+                yield u, a, '2012-01-01 00:00:00'
+    insert('app_userartist', ['user_id', 'artist_id', 'date'], user_artists())
+    db.execute("""
+        UPDATE "app_artist" SET "followers" = (
+            SELECT COUNT(*) FROM "app_userartist"
+            WHERE "app_userartist"."artist_id" = "app_artist"."id")
+        """)
+
+    def stars():
+        for u in xrange(1, users + 1):
+            starred = set()
+            for i in xrange(int(rnd.expovariate(1.0 / STARS))):
+                a = rnd.choice(follows[u])
+                if count[a]:
+                    starred.add(first[a] + rnd.randrange(count[a]) + 1)
+            for rg in starred:
+                yield u, rg
+    insert('app_star', ['user_id', 'release_group_id'], stars())
+    db.commit()
+
+    settings.DATABASES['default']['NAME'] = path
+    from app.models import Timeline
+    counts['app_timeline'] = Timeline.refill()
+
+    db.execute('ANALYZE')
+    db.close()
+    return counts
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    start = time.time()
+    counts = create(sys.argv[1], scale)
+    for table in sorted(counts):
+        sys.stdout.write('%-20s %10d rows\n' % (table, counts[table]))
+    sys.stdout.write('Created in %.1fs\n' % (time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
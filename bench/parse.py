@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Release group parsing throughput, tree vs. incremental parser.
+
+Usage: python -m bench.parse [rounds]
+
+Parses the recorded responses in bench/fixtures/release-group/, or 100
+synthetic pages if there are none.
+
+"""
+
+import glob
+import os
+import sys
+import time
+from xml.etree import ElementTree
+
+import app.musicbrainz as mb
+from bench.stub import release_groups_xml
+
+CHUNK_SIZE = 16384
+
+
+def load_fixtures():
+    path = os.path.join(os.path.dirname(__file__), 'fixtures', 'release-group', '*.xml')
+    pages = []
+    for filename in sorted(glob.glob(path)):
+        with open(filename, 'rb') as f:
+            pages.append(f.read())
+    if not pages:
+        pages = [release_groups_xml(i, 100, 100, 0) for i in xrange(100)]
+    return pages
+
+def parse_tree(xml):
+    """The parser used before, ElementTree in pure Python."""
+    root = ElementTree.fromstring(xml)
+    ns = root.tag[:root.tag.find('metadata')]
+    return [mb._parse_release_group(element, ns)
+            for element
+            in root.findall('%srelease-group-list/%srelease-group' % (ns, ns))]
+
+def parse_stream(xml):
+    chunks = (xml[i:i + CHUNK_SIZE] for i in xrange(0, len(xml), CHUNK_SIZE))
+    return list(mb._iter_list(chunks, 'release-group-list', mb._parse_release_group))
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    pages = load_fixtures()
+    size = sum(len(page) for page in pages)
+    for name, parse in (('tree', parse_tree), ('stream', parse_stream)):
+        items = 0
+        start = time.time()
+        for i in xrange(rounds):
+            for page in pages:
+                items += len(parse(page))
+        elapsed = time.time() - start
+        sys.stdout.write('%-8s %8.2f MB/s %10.0f release groups/s\n' % (
+                name, size * rounds / elapsed / 1e6, items / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check the query plans of the hot paths.
+
+Usage: python -m bench.plans path [-v]
+
+Runs the hot paths of bench.queries against a database created by
+bench.dataset, records every statement they send and prints its
+EXPLAIN QUERY PLAN. Exits with status 1 if a statement scans a whole
+table or uses a temporary B-tree, unless ALLOWED lists the step for that
+path. With -v, prints the plans of all statements.
+
+"""
+
+import os
+import re
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+import settings
+
+from bench import queries
+
+# Plan steps which are fine for the paths starting with the name, and why.
+ALLOWED = {
+    # The followed artists are sorted by name, the sort is bounded by the
+    # user's follows.
+    'artist_get_by_user': ['USE TEMP B-TREE FOR ORDER BY'],
+    # Only the new release groups of the followed artists are sorted.
+    'releases_handler_since': ['USE TEMP B-TREE FOR ORDER BY'],
+    # The queues are read from the start, the jobs in priority order.
+    # The users are scanned by the benchmark to queue the emails.
+    'notifications_send': ['SCAN app_job', 'SCAN app_notification', 'SCAN auth_user'],
+    }
+
+def record(connection, statements):
+    """Make the connection append the (sql, params) it sends to statements."""
+    from django.db.backends import util
+
+    class Recorder(util.CursorWrapper):
+        def execute(self, sql, params=()):
+            if not sql.lstrip().upper().startswith('EXPLAIN'):
+                statements.append((sql, params))
+            return self.cursor.execute(sql, params)
+
+    connection.use_debug_cursor = True
+    connection.make_debug_cursor = lambda cursor: Recorder(cursor, connection)
+
+def problems(plan, allowed=()):
+    """Return the full scans and temporary B-trees in the plan."""
+    found = []
+    for detail in plan:
+        if any(detail.startswith(step) for step in allowed):
+            continue
+        if re.match(r'SCAN \w+$', detail) or 'USE TEMP B-TREE' in detail:
+            found.append(detail)
+    return found
+
+def allowed(name):
+    return sum((steps for prefix, steps in ALLOWED.items() if name.startswith(prefix)), [])
+
+def check(verbose=False):
+    """Explain the statements of the hot paths, return the number of problems."""
+    from django.db import connection
+
+    statements = []
+    record(connection, statements)
+    paths = queries.hot_paths()
+    cursor = connection.cursor()
+    failed = 0
+    try:
+        for name, f, count in paths:
+            del statements[:]
+            f()
+            seen = set()
+            for sql, params in statements:
+                if not re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE)', sql, re.I):
+                    continue
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                found = problems(plan, allowed(name))
+                failed += len(found)
+                if found or verbose:
+                    sys.stdout.write('%s %s\n%s\n%s\n\n' % (
+                        'FAIL' if found else 'ok', name, ' '.join(sql.split()),
+                        '\n'.join('    ' + detail for detail in plan)))
+    finally:
+        queries.cleanup()
+    return failed
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+    settings.DATABASES['default']['NAME'] = os.path.abspath(sys.argv[1])
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    failed = check('-v' in sys.argv[2:])
+    sys.stdout.write('%d problems\n' % failed)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the hot database queries, print the results as JSON.
+
+Usage: python -m bench.queries path [rounds]
+
+Runs against a database created by bench.dataset, e.g.:
+
+    % python -m bench.dataset /tmp/bench.db 0.1
+    % python -m bench.queries /tmp/bench.db > results.json
+
+Each query runs rounds times (10 by default) for a heavy subject (the
+user following most artists, the most followed artist) and a typical one
+(the median). Compare the JSON between releases to spot regressions.
+The _page_N paths skip N pages with an offset, the _after_N ones continue
+from a page token, their times should not grow with N. Emails are sent
+to the local memory backend, without the pause between them.
+
+"""
+
+from datetime import date
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+import settings
+
+NOTIFICATIONS = 100 # sent by notifications.send()
+
+
+def hot_paths():
+    """Return [(name, f, count)], f runs the path once for count items.
+
+    The fan-out and the emails change the database, see cleanup().
+
+    """
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.client import RequestFactory
+    from api.handlers import ReleasesHandler
+    from app.models import Artist, ReleaseGroup
+    from app.tools import decode_page_token
+    from daemon import notifications, releases, tools
+
+    cursor = connection.cursor()
+    def select_one(sql):
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+
+    paths = []
+    users = select_one('SELECT COUNT(*) FROM "auth_user"')
+    heavy_user = User.objects.get(id=select_one("""
+        SELECT "user_id" FROM "app_userartist"
+        GROUP BY "user_id" ORDER BY COUNT(*) DESC LIMIT 1"""))
+    user = User.objects.get(id=select_one("""
+        SELECT "user_id" FROM "app_userartist" GROUP BY "user_id"
+        ORDER BY COUNT(*) LIMIT 1 OFFSET %d""" % (users // 2)))
+    artists = select_one('SELECT COUNT(*) FROM "app_artist"')
+    heavy_artist = Artist.objects.order_by('-followers')[0]
+    artist = Artist.objects.order_by('-followers')[artists // 2]
+
+    def page_after(q):
+        # The continuation token of the last release group on the page.
+        return decode_page_token(list(q)[-1].page_token())
+
+    def add(name, f, count=1):
+        paths.append((name, f, count))
+
+    for subject, u, a in (('heavy', heavy_user, heavy_artist), ('typical', user, artist)):
+        add('releasegroup_get_user_%s' % subject,
+            lambda u=u: list(ReleaseGroup.get(user=u, limit=40, offset=0)))
+        add('releasegroup_get_user_%s_page_10' % subject,
+            lambda u=u: list(ReleaseGroup.get(user=u, limit=40, offset=400)))
+        after = page_after(ReleaseGroup.get(user=u, limit=1, offset=399))
+        add('releasegroup_get_user_%s_after_10' % subject,
+            lambda u=u, after=after: list(ReleaseGroup.get(user=u, limit=40, after=after)))
+        add('releasegroup_get_artist_%s' % subject,
+            lambda a=a: list(ReleaseGroup.get(artist=a, limit=40, offset=0)))
+        add('artist_get_by_user_%s' % subject,
+            lambda u=u: list(Artist.get_by_user(u)))
+
+    today = int(date.today().strftime('%Y%m%d'))
+    add('releasegroup_get_calendar',
+        lambda: list(ReleaseGroup.get_calendar(today, 40, 0)))
+    add('releasegroup_get_calendar_page_10',
+        lambda: list(ReleaseGroup.get_calendar(today, 40, 400)))
+    for page in (10, 100):
+        after = page_after(ReleaseGroup.get_calendar(today, 1, 40 * page - 1))
+        add('releasegroup_get_calendar_after_%d' % page,
+            lambda after=after: list(ReleaseGroup.get_calendar(today, 40, 0, after=after)))
+    add('releasegroup_get_calendar_page_100',
+        lambda: list(ReleaseGroup.get_calendar(today, 40, 4000)))
+
+    # The release groups added since one of the last thousand.
+    since = ReleaseGroup.objects.get(id=select_one(
+        'SELECT MAX("id") - 1000 FROM "app_releasegroup"')).mbid
+    handler, factory = ReleasesHandler(), RequestFactory()
+    for subject, userid in (('all', None), ('heavy', heavy_user.username)):
+        request = factory.get('/api/1/releases', {'since': since, 'limit': 100})
+        add('releases_handler_since_%s' % subject,
+            lambda request=request, userid=userid: handler.read(request, userid))
+
+    # Notify the followers of the most followed artist about a new release group.
+    created = []
+    def fan_out():
+        mbid = 'bench-%d' % len(created)
+        created.append(mbid)
+        releases.apply_page(heavy_artist, {}, [
+            {'id': mbid, 'title': 'New', 'type': 'Album', 'first-release-date': str(today)}])
+    add('notification_fan_out_%d_followers' % heavy_artist.followers, fan_out)
+
+    tools.sleep = lambda: None
+    recent = ReleaseGroup.objects.filter(
+        date__lte=today, type='Album', is_deleted=False).order_by('-date')[0]
+    def send():
+        cursor.execute(
+            """
+            INSERT INTO "app_notification" ("user_id", "release_group_id")
+            SELECT "id", %s FROM "auth_user" ORDER BY "id" LIMIT %s
+            """, [recent.id, NOTIFICATIONS])
+        connection._commit()
+        notifications.send()
+    add('notifications_send_per_email', send, NOTIFICATIONS)
+    return paths
+
+def cleanup():
+    """Undo the changes made by the hot paths."""
+    from django.db import connection
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM "app_notification"')
+    cursor.execute(
+        """
+        DELETE FROM "app_timeline" WHERE "release_group_id" IN (
+            SELECT "id" FROM "app_releasegroup" WHERE "mbid" LIKE %s)
+        """, ['bench-%'])
+    cursor.execute('DELETE FROM "app_releasegroup" WHERE "mbid" LIKE %s', ['bench-%'])
+    connection._commit()
+
+def run(rounds):
+    results = {}
+    for name, f, count in hot_paths():
+        f() # warm up the page cache
+        times = []
+        for i in xrange(rounds):
+            start = time.time()
+            f()
+            times.append(1000.0 * (time.time() - start) / count)
+        times.sort()
+        results[name] = {
+            'min_ms': times[0],
+            'median_ms': times[len(times) // 2],
+            'max_ms': times[-1],
+            'rounds': rounds,
+            }
+    cleanup()
+    return results
+
+def dataset(path):
+    db = sqlite3.connect(path)
+    counts = {}
+    for table in ('auth_user', 'app_artist', 'app_releasegroup', 'app_userartist', 'app_star',
+                  'app_timeline'):
+        counts[table] = db.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+    db.close()
+    return counts
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+    path = os.path.abspath(sys.argv[1])
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    settings.DATABASES['default']['NAME'] = path
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    report = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'dataset': dataset(path),
+        'results': run(rounds),
+        }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record responses of the real web services as fixtures for bench/stub.py.
+
+Usage: python -m bench.record fixtures_dir [port]
+
+Runs a proxy on 127.0.0.1:port (8001 by default). Point MUSICBRAINZ_URL
+and LASTFM_URL in settings.py to it and use the site or run the daemon:
+requests are forwarded to MusicBrainz and Last.fm, the responses (and
+404s) are saved to fixtures_dir. Then serve them back with:
+
+    Server(fixtures=fixtures_dir)
+
+The Last.fm API key is not part of the fixture names, see fixture_name().
+Requests are sent as they come, the rate limit is up to the callers.
+
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import os
+from SocketServer import ThreadingMixIn
+import sys
+import tempfile
+from urllib2 import HTTPError
+
+from app import client
+from bench.stub import fixture_name
+
+MUSICBRAINZ_URL = 'http://musicbrainz.org'
+LASTFM_URL = 'http://ws.audioscrobbler.com'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        upstream = LASTFM_URL if self.path.startswith('/2.0/') else MUSICBRAINZ_URL
+        content_type = 'application/xml; charset=UTF-8'
+        try:
+            response = client.get(upstream + self.path)
+            body = response.read()
+            content_type = response.getheader('content-type', content_type)
+            code = 200
+        except HTTPError as e:
+            body, code = '', e.code
+        except Exception as e:
+            body, code = '', 502
+            self.log_error('%s: %s', self.path, e)
+
+        if code in (200, 404):
+            self.save(code, body)
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def save(self, code, body):
+        name = os.path.join(self.server.fixtures, fixture_name(self.path))
+        if code == 404:
+            name += '.404'
+        fd, tmp = tempfile.mkstemp(dir=self.server.fixtures, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.rename(tmp, name)
+        self.log_message('Recorded %s %d', self.path, code)
+
+
+class Recorder(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, port=8001):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.fixtures = fixtures
+        if not os.path.isdir(fixtures):
+            os.makedirs(fixtures)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8001
+    recorder = Recorder(sys.argv[1], port)
+    sys.stdout.write('Recording to %s, listening on 127.0.0.1:%d\n' % (sys.argv[1], port))
+    try:
+        recorder.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for the MusicBrainz and Last.fm web services.
+
+Usage: python -m bench.stub [options], see --help.
+
+Point MUSICBRAINZ_URL and LASTFM_URL in settings.py to the server, it
+serves the MusicBrainz web service (/ws/2/), release pages and covers
+(/release/, /cover/) and the Last.fm API (/2.0/), with keep-alive and
+gzip. Responses recorded by bench/record.py are served from the fixtures
+directory, others are synthesized: release group lists and searches,
+artists, releases, Last.fm top artists and album info.
+
+Round-trip time and bandwidth of a real network can be simulated: a new
+connection costs one RTT for the handshake, each response costs one RTT
+plus the time to transfer the body. A fraction of the requests can fail
+with HTTP 500, requests above max_rate get HTTP 503 with Retry-After,
+like MusicBrainz does.
+
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import gzip
+import hashlib
+from optparse import OptionParser
+import os
+import random
+import re
+from SocketServer import ThreadingMixIn
+import StringIO
+import sys
+import threading
+import time
+from urllib import urlencode
+from urlparse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+from PIL import Image
+
+MB_NS = 'http://musicbrainz.org/ns/mmd-2.0#'
+TYPES = ['Album', 'Single', 'EP', 'Live', 'Compilation', 'Remix', 'Other']
+
+
+def fake_mbid(*args):
+    h = hashlib.md5(':'.join(str(a) for a in args)).hexdigest()
+    return '%s-%s-%s-%s-%s' % (h[:8], h[8:12], h[12:16], h[16:20], h[20:32])
+
+def fixture_name(path):
+    """Return the fixture file name of the request path.
+
+    The query parameters are sorted and the API key is dropped, so that
+    recorded responses can be replayed with any key.
+
+    """
+    parts = urlsplit(path)
+    query = sorted((k, v) for k, v in parse_qs(parts.query).items() if k != 'api_key')
+    key = parts.path + '?' + urlencode(query, doseq=True)
+    return hashlib.sha1(key).hexdigest()
+
+def release_groups(artist, count, recent=0):
+    """Return the (mbid, type, title, date) of the artist's release groups.
+
+    The last recent ones were first released today.
+
+    """
+    items = []
+    for i in xrange(count):
+        date = '%04d-%02d-%02d' % (1970 + i % 45, 1 + i % 12, 1 + i % 28)
+        items.append((fake_mbid(artist, i), TYPES[i % len(TYPES)],
+                      'Release group %d of %s' % (i, artist), date))
+    today = time.strftime('%Y-%m-%d')
+    for i in xrange(recent):
+        items.append((fake_mbid(artist, 'recent', today, i), 'Album',
+                      'Recent release group %d of %s' % (i, artist), today))
+    return items
+
+def release_groups_xml(artist, count, limit, offset, recent=0):
+    items = release_groups(artist, count, recent)
+    return _release_group_list_xml(items[offset:offset + limit], len(items), offset)
+
+def search_xml(query, count, limit, offset, recent=0):
+    """Search the recent release groups of the arid: values in the query."""
+    items = []
+    for artist in re.findall(r'arid:([0-9a-f-]+)', query):
+        for item in release_groups(artist, count, recent)[count:]:
+            items.append(item + (artist,))
+    return _release_group_list_xml(items[offset:offset + limit], len(items), offset)
+
+def _release_group_list_xml(items, count, offset):
+    xml = []
+    for item in items:
+        mbid, type, title, date = item[:4]
+        credit = ''
+        if len(item) > 4:
+            credit = ('<artist-credit><name-credit><artist id="%s"><name>Artist</name>'
+                      '</artist></name-credit></artist-credit>' % item[4])
+        xml.append(
+            '<release-group id="%s" type="%s">'
+            '<title>%s</title>'
+            '<first-release-date>%s</first-release-date>'
+            '<primary-type>%s</primary-type>%s'
+            '</release-group>' % (mbid, type, escape(title), date, type, credit))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<metadata xmlns="%s">'
+            '<release-group-list count="%d" offset="%d">%s</release-group-list>'
+            '</metadata>' % (MB_NS, count, offset, ''.join(xml)))
+
+def artist_xml(mbid):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<metadata xmlns="%s">%s</metadata>' % (MB_NS, _artist_xml(mbid)))
+
+def artist_search_xml(query):
+    """Return the artists with the arid: values in the query."""
+    mbids = re.findall(r'([0-9a-f]{8}-[0-9a-f-]{27}|[0-9]{36})', query)
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<metadata xmlns="%s">'
+            '<artist-list count="%d" offset="0">%s</artist-list>'
+            '</metadata>' % (MB_NS, len(mbids), ''.join(_artist_xml(m) for m in mbids)))
+
+def _artist_xml(mbid):
+    return ('<artist id="%s" type="Group">'
+            '<name>Artist %s</name><sort-name>Artist %s</sort-name>'
+            '</artist>' % (mbid, mbid[:8], mbid[:8]))
+
+def releases_xml(release_group):
+    xml = []
+    for i in xrange(3):
+        xml.append('<release id="%s"><title>Release %d</title><date>%04d-01-01</date>'
+                   '</release>' % (fake_mbid(release_group, i), i, 2000 + i))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<metadata xmlns="%s">'
+            '<release-list count="3" offset="0">%s</release-list>'
+            '</metadata>' % (MB_NS, ''.join(xml)))
+
+def release_html(url, mbid):
+    return ('<html><body><div class="cover-art">\n'
+            '<img src="%s/cover/%s.jpg" /></div></body></html>' % (url, mbid))
+
+def cover_jpg(name):
+    """Return a noisy JPEG, large enough to pass as a real cover."""
+    rnd = random.Random(name)
+    im = Image.new('RGB', (200, 200))
+    im.putdata([(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255))
+                for i in xrange(200 * 200)])
+    f = StringIO.StringIO()
+    im.save(f, 'JPEG', quality=90)
+    return f.getvalue()
+
+def lastfm_artists_xml(username, count, limit, page):
+    """Return a page of the user's top artists, every 5th one without an MBID."""
+    xml = []
+    for i in xrange((page - 1) * limit, min(count, page * limit)):
+        mbid = fake_mbid('lastfm', i) if i % 5 else ''
+        xml.append('<artist rank="%d"><name>Artist %d</name><playcount>%d</playcount>'
+                   '<mbid>%s</mbid></artist>' % (i + 1, i, 1000 - i, mbid))
+    pages = max(1, (count + limit - 1) // limit)
+    return ('<?xml version="1.0" encoding="utf-8"?><lfm status="ok">'
+            '<topartists user="%s" page="%d" perPage="%d" totalPages="%d" total="%d">'
+            '%s</topartists></lfm>' % (escape(username), page, limit, pages, count, ''.join(xml)))
+
+def lastfm_album_xml(url, artist, album):
+    name = hashlib.md5(artist + ':' + album).hexdigest()
+    images = ''.join('<image size="%s">%s/cover/%s-%s.jpg</image>' % (size, url, name, size)
+                     for size in ('small', 'medium', 'large', 'extralarge'))
+    return ('<?xml version="1.0" encoding="utf-8"?><lfm status="ok">'
+            '<album><name>%s</name><artist>%s</artist>%s</album></lfm>'
+            % (escape(album), escape(artist), images))
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and the body in one segment.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        time.sleep(self.server.rtt)
+
+    def do_GET(self):
+        server = self.server
+        if server.throttle():
+            self.send_body('', code=503, headers={'Retry-After': '1'})
+            return
+        if random.random() < server.error_rate:
+            self.send_body('', code=500)
+            return
+        found, body = server.fixture(self.path)
+        if found:
+            if body is None:
+                self.send_body('', code=404)
+            else:
+                self.send_body(body)
+            return
+
+        parts = urlsplit(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(parts.query).items())
+        path = parts.path.rstrip('/').split('/')
+        if parts.path.startswith('/2.0/'):
+            self.do_lastfm(query)
+            return
+        limit, offset = int(query.get('limit', 25)), int(query.get('offset', 0))
+        if path[-1] == 'release-group' and 'query' in query:
+            body = search_xml(query['query'], server.release_groups,
+                              limit, offset, server.recent)
+        elif path[-1] == 'release-group':
+            body = release_groups_xml(
+                query.get('artist', ''), server.release_groups,
+                limit, offset, server.recent)
+        elif path[-1] == 'artist' and 'query' in query:
+            body = artist_search_xml(query['query'])
+        elif len(path) > 1 and path[-2] == 'artist':
+            body = artist_xml(path[-1])
+        elif path[-1] == 'release':
+            body = releases_xml(query.get('release-group', ''))
+        elif len(path) > 1 and path[-2] == 'release':
+            self.send_body(release_html(server.url, path[-1]), 'text/html; charset=UTF-8')
+            return
+        elif len(path) > 1 and path[-2] == 'cover':
+            self.send_body(cover_jpg(path[-1]), 'image/jpeg')
+            return
+        else:
+            self.send_body('', code=404)
+            return
+        self.send_body(body)
+
+    def do_lastfm(self, query):
+        method = query.get('method')
+        if method == 'user.getTopArtists':
+            body = lastfm_artists_xml(
+                query.get('user', ''), self.server.lastfm_artists,
+                int(query.get('limit', 50)), int(query.get('page', 1)))
+        elif method == 'album.getInfo':
+            body = lastfm_album_xml(self.server.url, query.get('artist', ''),
+                                    query.get('album', ''))
+        else:
+            body = ('<?xml version="1.0" encoding="utf-8"?><lfm status="failed">'
+                    '<error code="3">Invalid Method</error></lfm>')
+        self.send_body(body, 'text/xml; charset=utf-8')
+
+    def send_body(self, body, content_type='application/xml; charset=UTF-8',
+                  code=200, headers={}):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            f = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(body)
+            body = f.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        time.sleep(self.server.rtt + float(len(body)) / self.server.bandwidth)
+        self.wfile.write(body)
+        self.server.count(code, len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, port=0, release_groups=100, rtt=0.0, bandwidth=1e12, recent=0,
+                 fixtures=None, error_rate=0.0, max_rate=None, lastfm_artists=200):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.release_groups = release_groups
+        self.recent = recent # release groups released today, per artist
+        self.rtt = rtt # seconds
+        self.bandwidth = bandwidth # bytes per second
+        self.fixtures = fixtures # directory with recorded responses
+        self.error_rate = error_rate # fraction of requests failing with 500
+        self.max_rate = max_rate # requests per second, 503 above it
+        self.lastfm_artists = lastfm_artists # top artists per user
+        self.lock = threading.Lock()
+        self._tokens, self._time = max_rate or 0, time.time()
+        self.reset()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def get_request(self):
+        with self.lock:
+            self.connections += 1
+        return HTTPServer.get_request(self)
+
+    def count(self, code, bytes):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += bytes
+            if code == 500:
+                self.errors += 1
+            elif code == 503:
+                self.throttled += 1
+
+    def reset(self):
+        self.connections = self.requests = self.bytes_sent = 0
+        self.errors = self.throttled = 0
+
+    def throttle(self):
+        """Return True if the request is above max_rate."""
+        if not self.max_rate:
+            return False
+        with self.lock:
+            now = time.time()
+            self._tokens = min(self.max_rate, self._tokens + (now - self._time) * self.max_rate)
+            self._time = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def fixture(self, path):
+        """Return (found, body) of the recorded response, body is None for 404."""
+        if not self.fixtures:
+            return False, None
+        name = os.path.join(self.fixtures, fixture_name(path))
+        if os.path.exists(name + '.404'):
+            return True, None
+        try:
+            with open(name, 'rb') as f:
+                return True, f.read()
+        except IOError:
+            return False, None
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = OptionParser(usage='python -m bench.stub [options]')
+    parser.add_option('-p', '--port', type='int', default=8000)
+    parser.add_option('-f', '--fixtures', help='serve the responses recorded here')
+    parser.add_option('-r', '--release-groups', type='int', default=100,
+                      help='release groups per artist')
+    parser.add_option('--recent', type='int', default=0,
+                      help='release groups released today, per artist')
+    parser.add_option('--rtt', type='float', default=0.0, help='round trip time, ms')
+    parser.add_option('--error-rate', type='float', default=0.0,
+                      help='fraction of requests failing with HTTP 500')
+    parser.add_option('--max-rate', type='float',
+                      help='requests per second, HTTP 503 above it')
+    options, args = parser.parse_args()
+    server = Server(options.port, options.release_groups, options.rtt / 1000,
+                    recent=options.recent, fixtures=options.fixtures,
+                    error_rate=options.error_rate, max_rate=options.max_rate)
+    sys.stdout.write('Listening on %s\n' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
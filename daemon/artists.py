@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Refresh the artist names from MB.
+
+Instead of looking up the artists one by one, search for up to BATCH
+artists at once with an arid:(a OR b ...) query and apply the renames
+in bulk. Merged artists are not returned by the search, they are
+queued as jobs and looked up one by one, see jobs.update_artist().
+
+"""
+
+import logging
+import time
+
+from django.db import connection, transaction
+
+from app.models import *
+import app.musicbrainz as mb
+
+BATCH = 100 # artists per search
+RETRIES = 3 # searches per batch
+RETRY_DELAY = 10 # seconds, doubled after each failed search
+MAX_FAILED = 3 # batches in a row, MB is probably down
+
+
+def refresh():
+    """Refresh all artists, return the number of renamed artists.
+
+    A batch which could not be searched after RETRIES attempts is
+    skipped. Give up after MAX_FAILED such batches in a row and return
+    None, the refresh should be tried again later.
+
+    """
+    logging.info('Refreshing artists')
+    q = Artist.objects.order_by('id')
+    ids = list(q.values_list('id', flat=True))
+    requests = renamed = queued = failed = 0
+    for i in xrange(0, len(ids), BATCH):
+        batch = list(Artist.objects.filter(id__in=ids[i:i + BATCH]))
+        for attempt in xrange(RETRIES):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            found = mb.get_artists([artist.mbid for artist in batch])
+            requests += 1
+            if found is not None:
+                break
+            logging.warning('Could not search artists')
+        if found is None:
+            failed += 1
+            if failed >= MAX_FAILED:
+                logging.error('[ERR] Could not search artists %d times in a row, '
+                              'giving up the refresh' % (failed * RETRIES))
+                return None
+            logging.warning('[ERR] Skipping %d artists' % len(batch))
+            continue
+        failed = 0
+
+        changed = []
+        for artist in batch:
+            artist_data = found.get(artist.mbid)
+            if artist_data is None:
+                # Merged, deleted or not indexed yet.
+                Job.update_artist(artist.mbid)
+                queued += 1
+            else:
+                changed.append((artist, artist_data))
+        renamed += update(changed)
+
+    logging.info('Refreshed %d artists with %d requests, renamed %d, queued %d'
+                 % (len(ids), requests, renamed, queued))
+    return renamed
+
+def update(artists):
+    """Apply the MB data to a list of (artist, artist_data) in bulk.
+
+    Return the number of changed artists.
+
+    """
+    rows = []
+    for artist, artist_data in artists:
+        name = artist_data['name']
+        sort_name = artist_data['sort-name']
+        disambiguation = artist_data.get('disambiguation') or ''
+        if (artist.name != name or artist.sort_name != sort_name or
+            artist.disambiguation != disambiguation):
+            logging.info('Artist %s changed, updating' % artist.mbid)
+            rows.append((name, sort_name, disambiguation, artist.id))
+    if rows:
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.executemany(
+                """
+                UPDATE "app_artist"
+                SET "name" = %s, "sort_name" = %s, "disambiguation" = %s
+                WHERE "id" = %s
+                """, rows)
+    return len(rows)
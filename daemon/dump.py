@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Check for new releases against a local copy of the MB data.
+
+Instead of querying the web service, load the MusicBrainz JSON data
+dumps into two compact tables (app_dumpartist, app_dumpreleasegroup)
+and diff app_releasegroup against them with a few set-based queries.
+
+The dump files have one entity per line, as in the mbdump/artist and
+mbdump/release-group files of the JSON dumps (extract them from the
+tarballs first, they can be gzipped or bzipped). Tab-separated files
+are also accepted:
+
+* artists: mbid, name, sort name, disambiguation
+* release groups: artist mbid, mbid, type, first release date, title
+
+Incremental files have the same format, a JSON line {"id": mbid,
+"deleted": true} or a TSV line with only the mbid removes an entity.
+apply_dir() applies new files from a directory in name order and
+remembers the applied ones in app_dumpfile.
+
+"""
+
+import bz2
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import time
+
+from django.db import connection, transaction
+
+from app.models import *
+from app.tools import str_to_date
+from daemon import notifications
+
+BATCH_SIZE = 1000 # rows per executemany()
+IDLE_DELAY = 60 # seconds
+
+# The ws/2 "type" of a release group is its primary type, unless it has
+# one of these secondary types.
+SECONDARY_TYPES = ['Compilation', 'Soundtrack', 'Spokenword', 'Interview',
+                   'Audiobook', 'Live', 'Remix']
+
+
+def load(path, full=False):
+    """Load a dump file, return the number of loaded entities.
+
+    With full=True, the entities of each type found in the file replace
+    the existing ones, otherwise the file is an incremental update.
+
+    """
+    logging.info('Loading %s' % path)
+    artists, release_groups, deleted = [], [], []
+    cleared = set()
+    count = 0
+    cursor = connection.cursor()
+    with transaction.commit_on_success():
+        for kind, row in _parse(_open(path)):
+            if full and kind != 'deleted' and kind not in cleared:
+                cursor.execute('DELETE FROM "app_dump%s"' % kind)
+                cleared.add(kind)
+            {'artist': artists, 'releasegroup': release_groups,
+             'deleted': deleted}[kind].append(row)
+            count += 1
+            if len(artists) + len(release_groups) + len(deleted) >= BATCH_SIZE:
+                _write(cursor, artists, release_groups, deleted)
+                artists, release_groups, deleted = [], [], []
+        _write(cursor, artists, release_groups, deleted)
+    logging.info('Loaded %d entities' % count)
+    return count
+
+def apply_dir(dirname):
+    """Apply the incremental files in dirname which were not applied yet."""
+    names = _new_files(dirname)
+    for name in names:
+        load(os.path.join(dirname, name))
+        DumpFile(name=name, applied=datetime.now()).save()
+    return len(names)
+
+def run(dirname):
+    """Wait for new files in dirname, apply them and check the artists.
+
+    Send the emails and process the jobs while waiting, like
+    releases.check() does. Return the checkpoint with the stats.
+
+    """
+    sent_notifications = 0
+    while not _new_files(dirname):
+        sent_notifications += notifications.send()
+        time.sleep(IDLE_DELAY)
+    apply_dir(dirname)
+    checkpoint = check()
+    checkpoint.sent_notifications = sent_notifications + notifications.send()
+    return checkpoint
+
+def check():
+    """Diff the release groups of all artists against the dump.
+
+    Only artists present in the dump are checked, the users are notified
+    about the new release groups of the artists checked before. Return
+    a Checkpoint with the stats, it is not saved.
+
+    """
+    logging.info('Checking artists against the dump')
+    now = datetime.now()
+    cursor = connection.cursor()
+    with transaction.commit_on_success():
+        cursor.execute('DROP TABLE IF EXISTS "temp"."dump_changed"')
+        cursor.execute('CREATE TEMP TABLE "dump_changed" ("artist_id" integer, "mbid" varchar(36))')
+
+        # Valid release groups of our artists, see apply_page().
+        valid = """
+            SELECT "app_artist"."id" AS "artist_id", "d"."mbid", "d"."name", "d"."type", "d"."date"
+            FROM "app_artist"
+            JOIN "app_dumpreleasegroup" "d" ON "d"."artist_mbid" = "app_artist"."mbid"
+            WHERE "d"."date" > 0 AND "d"."type" != ''
+            """
+
+        # New release groups.
+        cursor.execute(
+            """
+            INSERT INTO "temp"."dump_changed" ("artist_id", "mbid")
+            SELECT "v"."artist_id", "v"."mbid" FROM (%s) "v"
+            WHERE "v"."name" != '' AND NOT EXISTS (
+                SELECT 1 FROM "app_releasegroup" "r"
+                WHERE "r"."artist_id" = "v"."artist_id" AND "r"."mbid" = "v"."mbid")
+            """ % valid)
+        cursor.execute(
+            """
+            INSERT INTO "app_releasegroup"
+            ("artist_id", "mbid", "name", "type", "date", "is_deleted")
+            SELECT "v"."artist_id", "v"."mbid", "v"."name", "v"."type", "v"."date", %%s
+            FROM (%s) "v"
+            JOIN "temp"."dump_changed" "c"
+            ON "c"."artist_id" = "v"."artist_id" AND "c"."mbid" = "v"."mbid"
+            """ % valid, [False])
+        created = cursor.rowcount
+        cursor.execute(
+            """
+            INSERT INTO "app_notification" ("user_id", "release_group_id")
+            SELECT "app_userartist"."user_id", "r"."id"
+            FROM "temp"."dump_changed" "c"
+            JOIN "app_releasegroup" "r"
+            ON "r"."artist_id" = "c"."artist_id" AND "r"."mbid" = "c"."mbid"
+            JOIN "app_userartist" ON "app_userartist"."artist_id" = "c"."artist_id"
+            JOIN "app_artist" ON "app_artist"."id" = "c"."artist_id"
+            WHERE "app_artist"."last_checked" IS NOT NULL
+            """)
+        notified = cursor.rowcount
+
+        # Changed and undeleted release groups, an empty title in the dump
+        # keeps the current one.
+        changed = """
+            SELECT "r"."id" FROM "app_releasegroup" "r"
+            JOIN (%s) "v" ON "v"."artist_id" = "r"."artist_id" AND "v"."mbid" = "r"."mbid"
+            WHERE "r"."name" != COALESCE(NULLIF("v"."name", ''), "r"."name") OR "r"."type" != "v"."type"
+            OR "r"."date" != "v"."date" OR "r"."is_deleted"
+            """ % valid
+        cursor.execute(
+            """
+            INSERT INTO "temp"."dump_changed" ("artist_id", "mbid")
+            SELECT "artist_id", "mbid" FROM "app_releasegroup"
+            WHERE "id" IN (%s)
+            """ % changed)
+        column = """(
+            SELECT "d"."%s" FROM "app_artist"
+            JOIN "app_dumpreleasegroup" "d" ON "d"."artist_mbid" = "app_artist"."mbid"
+            WHERE "app_artist"."id" = "app_releasegroup"."artist_id"
+            AND "d"."mbid" = "app_releasegroup"."mbid")"""
+        cursor.execute(
+            """
+            UPDATE "app_releasegroup"
+            SET "name" = COALESCE(NULLIF(%s, ''), "app_releasegroup"."name"), "type" = %s, "date" = %s, "is_deleted" = %%s
+            WHERE "id" IN (%s)
+            """ % (column % 'name', column % 'type', column % 'date', changed), [False])
+        updated = cursor.rowcount
+
+        # Release groups no longer in the dump, or without a date or a type.
+        missing = """
+            SELECT "r"."id", "r"."artist_id", "r"."mbid" FROM "app_releasegroup" "r"
+            JOIN "app_artist" ON "app_artist"."id" = "r"."artist_id"
+            JOIN "app_dumpartist" ON "app_dumpartist"."mbid" = "app_artist"."mbid"
+            WHERE NOT "r"."is_deleted" AND NOT EXISTS (
+                SELECT 1 FROM "app_dumpreleasegroup" "d"
+                WHERE "d"."artist_mbid" = "app_artist"."mbid" AND "d"."mbid" = "r"."mbid"
+                AND "d"."date" > 0 AND "d"."type" != '')
+            """
+        cursor.execute(
+            """
+            INSERT INTO "temp"."dump_changed" ("artist_id", "mbid")
+            SELECT "artist_id", "mbid" FROM (%s)
+            """ % missing)
+        cursor.execute(
+            """
+            UPDATE "app_releasegroup" SET "is_deleted" = %%s
+            WHERE "id" IN (SELECT "id" FROM (%s))
+            """ % missing, [True])
+        deleted = cursor.rowcount
+
+        cursor.execute(
+            """
+            UPDATE "app_artist" SET "last_changed" = %s
+            WHERE "id" IN (SELECT "artist_id" FROM "temp"."dump_changed")
+            """, [now])
+        cursor.execute(
+            """
+            UPDATE "app_artist" SET "last_checked" = %s
+            WHERE "mbid" IN (SELECT "mbid" FROM "app_dumpartist")
+            """, [now])
+        checked_artists = cursor.rowcount
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM "app_releasegroup"
+            JOIN "app_artist" ON "app_artist"."id" = "app_releasegroup"."artist_id"
+            JOIN "app_dumpartist" ON "app_dumpartist"."mbid" = "app_artist"."mbid"
+            """)
+        checked_release_groups = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            SELECT "r"."id" FROM "temp"."dump_changed" "c"
+            JOIN "app_releasegroup" "r"
+            ON "r"."artist_id" = "c"."artist_id" AND "r"."mbid" = "c"."mbid"
+            """)
+        changed = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DROP TABLE "temp"."dump_changed"')
+        for i in xrange(0, len(changed), BATCH_SIZE):
+            Timeline.refill(ids=changed[i:i + BATCH_SIZE])
+
+    logging.info('Created %d, updated %d and deleted %d release groups'
+                 % (created, updated, deleted))
+    logging.info('Will notify %d users' % notified)
+    return Checkpoint(
+        started=now, updated=datetime.now(), update_artists=False, artist_mbid='',
+        checked_artists=checked_artists, checked_release_groups=checked_release_groups)
+
+
+def _new_files(dirname):
+    applied = set(DumpFile.objects.values_list('name', flat=True))
+    return [name for name in sorted(os.listdir(dirname))
+            if not name.startswith('.') and name not in applied]
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    return open(path, 'rb')
+
+def _parse(lines):
+    """Yield (kind, row) for each line, kind is artist, releasegroup or deleted."""
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if line.startswith('{'):
+            for item in _parse_json(json.loads(line)):
+                yield item
+            continue
+        fields = line.decode('utf-8').split('\t')
+        if len(fields) == 1:
+            yield 'deleted', fields[0]
+        elif len(fields) == 4:
+            yield 'artist', tuple(fields)
+        elif len(fields) == 5:
+            artist, mbid, type, date, title = fields
+            yield 'releasegroup', (artist, mbid, title, type, str_to_date(date))
+        else:
+            logging.warning('Skipping a malformed line: %r' % line[:100])
+
+def _parse_json(entity):
+    mbid = entity['id']
+    if entity.get('deleted'):
+        yield 'deleted', mbid
+    elif 'artist-credit' in entity:
+        type = entity.get('primary-type') or ''
+        for secondary in SECONDARY_TYPES:
+            if secondary in (entity.get('secondary-types') or []):
+                type = secondary
+                break
+        date = str_to_date(entity.get('first-release-date'))
+        for credit in entity['artist-credit']:
+            yield 'releasegroup', (
+                credit['artist']['id'], mbid, entity.get('title') or '', type, date)
+    else:
+        yield 'artist', (mbid, entity.get('name') or '', entity.get('sort-name') or '',
+                         entity.get('disambiguation') or '')
+
+def _write(cursor, artists, release_groups, deleted):
+    # An updated release group replaces all its rows, its credits could change.
+    mbids = deleted + [row[1] for row in release_groups]
+    if mbids:
+        cursor.executemany(
+            'DELETE FROM "app_dumpreleasegroup" WHERE "mbid" = %s',
+            [(mbid,) for mbid in set(mbids)])
+    if deleted:
+        cursor.executemany(
+            'DELETE FROM "app_dumpartist" WHERE "mbid" = %s', [(mbid,) for mbid in deleted])
+        cursor.executemany(
+            'DELETE FROM "app_dumpreleasegroup" WHERE "artist_mbid" = %s',
+            [(mbid,) for mbid in deleted])
+    if artists:
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO "app_dumpartist"
+            ("mbid", "name", "sort_name", "disambiguation")
+            VALUES (%s, %s, %s, %s)
+            """, artists)
+    if release_groups:
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO "app_dumpreleasegroup"
+            ("artist_mbid", "mbid", "name", "type", "date")
+            VALUES (%s, %s, %s, %s, %s)
+            """, release_groups)
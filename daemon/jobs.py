@@ -15,98 +15,318 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with muspy.  If not, see <http://www.gnu.org/licenses/>.
 
+"""Background jobs triggered by the users and by the daemon.
+
+Jobs are queued in the Job table and run in the order of their priority
+and of their run_at time, see Job.PRIORITIES. The daemon processes them
+between the emails, daemon/worker runs them in separate processes so
+that the urgent ones start within seconds whatever the daemon is doing.
+
+A worker leases the job it runs, like the scheduler leases artists. If
+the worker dies, the job is run again once the lease expires or when
+the worker's parent releases it. With several workers, the first one
+only runs the urgent jobs, so that they don't wait for a long import.
+
+The jobs which only depend on their data (see Job.COALESCED) have a
+unique key, queueing one again while it's pending or running only bumps
+its coalesced counter, which is logged once it's done. A job queued
+again while it was running runs once more, the new request could need
+newer data than it fetched.
+
+A job which fails (raises JobError, e.g. if MusicBrainz is down, or any
+other exception) is retried with an exponential backoff. After
+Job.MAX_ATTEMPTS it is moved to the DeadJob table with its last error.
+
+"""
+
+from datetime import datetime, timedelta
 import logging
+import multiprocessing
 import re
+import signal
 import StringIO
-from urllib2 import Request, urlopen
+import sys
+import time
+import traceback
 
+from django.db import connection, transaction
+from django.db.models import Q
 from PIL import Image
+from settings import MUSICBRAINZ_URL
 
-from app import lastfm
+from app import client, lastfm, ratelimit
 from app.cover import Cover
 from app.models import *
 import app.musicbrainz as mb
-from app.tools import str_to_date
-from daemon import tools
+from app.tools import normalize_name, str_to_date
+from daemon import artists, scheduler
+
+LEASE_TIME = timedelta(hours=1)
+RETRY_DELAY = timedelta(minutes=1) # after the first failure, doubles after each one
+MAX_RETRY_DELAY = timedelta(hours=6)
+POLL_DELAY = 1 # seconds between the checks of an empty queue
+NAME_MAX_AGE = timedelta(days=90) # see resolve_names()
+
+_workers = False
+
 
+class JobError(Exception):
+    """The job failed but could succeed if retried later."""
+
+
+def use_workers():
+    """Leave the jobs to daemon/worker, process() does nothing."""
+    global _workers
+    _workers = True
 
 def process():
-    """Work on pending jobs."""
+    """Work on the due jobs until none is left."""
+    if _workers:
+        return
+    owner = scheduler.owner()
     while True:
-        try:
-            job = Job.objects.select_related('user').order_by('id')[0]
-        except IndexError:
+        job = claim(owner)
+        if job is None:
             break
+        run(job)
 
-        if job.type == Job.ADD_ARTIST:
-            if not add_artist(job.user, job.data):
-                tools.sleep()
-                continue
-        elif job.type == Job.ADD_RELEASE_GROUPS:
-            if not add_release_groups(job.data):
-                tools.sleep()
+def work(max_priority=None):
+    """Work on the jobs as they become due, never return.
+
+    With max_priority, only run the jobs with this priority or lower.
+
+    """
+    owner = scheduler.owner()
+    while True:
+        job = claim(owner, max_priority)
+        if job is None:
+            time.sleep(POLL_DELAY)
+            continue
+        run(job)
+
+def run_workers(count):
+    """Run work() in count processes, replace the ones which die."""
+    # Stop the workers and release their jobs when terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    processes = {} # pid: (process, max_priority)
+    try:
+        while True:
+            while len(processes) < count:
+                urgent = [p for p, m in processes.values() if m is not None]
+                max_priority = Job.URGENT if count > 1 and not urgent else None
+                # Don't share the database and HTTP connections with the child.
+                connection.close()
+                client.close()
+                process = multiprocessing.Process(target=_worker, args=(max_priority,))
+                process.start()
+                processes[process.pid] = process, max_priority
+                logging.info('Started worker %d' % process.pid)
+            for pid, (process, max_priority) in processes.items():
+                process.join(POLL_DELAY)
+                if process.is_alive():
+                    continue
+                _died(pid)
+                del processes[pid]
+    finally:
+        for pid, (process, max_priority) in processes.items():
+            if not process.is_alive():
+                _died(pid)
                 continue
-        elif job.type == Job.GET_COVER:
-            get_cover(job.data)
-        elif job.type == Job.IMPORT_LASTFM:
-            count, period, username = job.data.split(',', 2)
-            import_lastfm(job.user, username, int(count), period)
+            # Stopped by us, not by its job.
+            process.terminate()
+            process.join()
+            release(scheduler.owner(pid))
+
+def claim(owner, max_priority=None, now=None):
+    """Lease the most urgent due job to owner, return it or None.
+
+    With max_priority, only lease a job with this priority or lower.
+
+    """
+    now = now or datetime.now()
+    free = Q(lease_until__isnull=True) | Q(lease_until__lte=now)
+    while True:
+        q = Job.objects.filter(free, run_at__lte=now)
+        if max_priority is not None:
+            q = q.filter(priority__lte=max_priority)
+        ids = list(q.order_by('priority', 'run_at', 'id').values_list('id', flat=True)[:1])
+        if not ids:
+            return None
+        with transaction.commit_on_success():
+            # Another worker could have taken it meanwhile.
+            leased = Job.objects.filter(free, id=ids[0]).update(
+                lease_owner=owner, lease_until=now + LEASE_TIME)
+        if leased:
+            q = Job.objects.select_related('user').filter(id=ids[0], lease_owner=owner)
+            jobs = list(q)
+            if jobs:
+                return jobs[0]
+
+def release(owner):
+    """Release the jobs leased by owner, they will run again."""
+    Job.objects.filter(lease_owner=owner).update(lease_owner='', lease_until=None)
+
+def run(job):
+    """Run the job, delete it once done or retry it later if it failed."""
+    if job.priority == Job.URGENT:
+        # A user is waiting, don't yield to the daemon's requests.
+        priority = ratelimit.INTERACTIVE
+    else:
+        priority = ratelimit.BACKGROUND
+    try:
+        with ratelimit.priority(priority):
+            _run(job)
+    except JobError as e:
+        failed(job, unicode(e))
+    except Exception:
+        logging.exception('[ERR] Job %d failed' % job.id)
+        # Don't keep the transaction of the failed job.
+        transaction.rollback_unless_managed()
+        failed(job, traceback.format_exc())
+    else:
+        done(job)
+
+def done(job):
+    """Delete the job, unless it was queued again while it was running."""
+    with transaction.commit_on_success():
+        q = Job.objects.filter(id=job.id)
+        # The update takes the write lock, Job.add() can't count a
+        # request between it and the delete.
+        requeued = q.exclude(coalesced=job.coalesced).update(
+            run_at=datetime.now(), lease_owner='', lease_until=None, attempts=0, error='')
+        if not requeued:
+            coalesced = q.values_list('coalesced', flat=True)
+            if coalesced and coalesced[0]:
+                logging.info('[JOB] Done, %d duplicate requests were merged' % coalesced[0])
+            q.delete()
+    if requeued:
+        logging.info('[JOB] Queued again while running, will run again')
+
+def failed(job, error, now=None):
+    """Schedule the next attempt of the job, or give up on it."""
+    now = now or datetime.now()
+    attempts = job.attempts + 1
+    if attempts >= Job.MAX_ATTEMPTS[job.type]:
+        logging.error('[ERR] Job %d failed %d times, giving up: %s' % (job.id, attempts, error))
+        with transaction.commit_on_success():
+            DeadJob(user=job.user, type=job.type, data=job.data,
+                    attempts=attempts, error=error).save()
+            Job.objects.filter(id=job.id).delete()
+        return
+    delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (attempts - 1))
+    logging.warning('[ERR] Job %d failed, retrying in %s: %s' % (job.id, delay, error))
+    Job.objects.filter(id=job.id).update(
+        attempts=attempts, error=error, run_at=now + delay, lease_owner='', lease_until=None)
+
+def _died(pid):
+    """Count the job of a dead worker as a failed attempt.
 
-        job.delete()
+    A job which kills its worker would be leased again forever if it was
+    only released.
+
+    """
+    logging.error('Worker %d died' % pid)
+    for job in Job.objects.select_related('user').filter(lease_owner=scheduler.owner(pid)):
+        failed(job, 'Worker %d died' % pid)
+
+def _run(job):
+    if job.type == Job.ADD_ARTIST:
+        add_artist(job.user, job.data)
+    elif job.type == Job.ADD_RELEASE_GROUPS:
+        add_release_groups(job.data)
+    elif job.type == Job.GET_COVER:
+        get_cover(job.data)
+    elif job.type == Job.IMPORT_LASTFM:
+        count, period, username = job.data.split(',', 2)
+        import_lastfm(job.user, username, int(count), period)
+    elif job.type == Job.UPDATE_ARTIST:
+        update_artist(job.data)
+
+def _worker(max_priority):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        work(max_priority)
+    except:
+        logging.exception('Worker error')
+        raise
+    finally:
+        connection.close()
 
 
 def add_artist(user, search):
-    tools.sleep()
     logging.info('[JOB] Searching for artist [%s] for user %d' % (search, user.id))
-    found_artists, count = mb.search_artists(search, limit=2, offset=0)
-    if found_artists is None:
-        logging.warning('[ERR] MusicBrainz error while searching, skipping')
-        return True
+    mbid = resolve_names([search]).get(search)
+    if mbid is None:
+        found_artists, count = mb.search_artists(search, limit=2, offset=0)
+        if found_artists is None:
+            raise JobError('MusicBrainz error while searching')
 
-    only_one = len(found_artists) == 1
-    first_is_exact = (len(found_artists) > 1 and
-                      found_artists[0]['name'].lower() == search.lower() and
-                      found_artists[1]['name'].lower() != search.lower())
-    if only_one or first_is_exact:
-        artist_data = found_artists[0]
-        mbid = artist_data['id']
+        only_one = len(found_artists) == 1
+        first_is_exact = (len(found_artists) > 1 and
+                          found_artists[0]['name'].lower() == search.lower() and
+                          found_artists[1]['name'].lower() != search.lower())
+        if only_one or first_is_exact:
+            mbid = found_artists[0]['id']
+        elif found_artists:
+            mbid = ''
+        if mbid is not None:
+            ArtistName.found(search, mbid)
+    else:
+        logging.info('[JOB] Resolved the name without searching')
 
-        # get_by_mbid() queries MB, must sleep.
-        tools.sleep()
+    if mbid:
         logging.info('[JOB] Adding artist %s' % mbid)
         try:
             artist = Artist.get_by_mbid(mbid)
         except Artist.Blacklisted:
             logging.warning('[ERR] Artist %s is blacklisted, skipping' % mbid)
-            return True
+            return
         except Artist.Unknown:
             logging.warning('[ERR] Artist %s is unknown, skipping' % mbid)
-            return True
+            return
         if not artist:
-            logging.warning('[ERR] Could not fetch artist %s, retrying' % mbid)
-            return False
+            raise JobError('Could not fetch artist %s' % mbid)
         UserArtist.add(user, artist)
     else:
         logging.info('[JOB] Could not identify artist by name, saving for later')
         UserSearch(user=user, search=search).save()
 
-    return True
+def resolve_names(names, now=None):
+    """Look the names up in ArtistName, return {name: mbid} for the known ones.
+
+    The mbid is empty if the name is ambiguous. Names resolved longer
+    than NAME_MAX_AGE ago are searched again.
+
+    """
+    now = now or datetime.now()
+    keys = {}
+    for name in names:
+        keys.setdefault(normalize_name(name), []).append(name)
+    resolved = {}
+    keys_list = keys.keys()
+    for i in xrange(0, len(keys_list), artists.BATCH):
+        q = ArtistName.objects.filter(
+            name__in=keys_list[i:i + artists.BATCH], updated__gte=now - NAME_MAX_AGE)
+        for key, mbid in q.values_list('name', 'mbid'):
+            for name in keys[key]:
+                resolved[name] = mbid
+    return resolved
 
 def add_release_groups(mbid):
     logging.info('[JOB] Fetching release groups for artist %s' % mbid)
     try:
         artist = Artist.objects.get(mbid=mbid)
     except Artist.DoesNotExist:
-        logging.warning('[ERR] Cannot find by mbid, skipping' % mbid)
-        return True
+        logging.warning('[ERR] Cannot find %s by mbid, skipping' % mbid)
+        return
 
     LIMIT = 100
     offset = 0
     while True:
-        tools.sleep()
         logging.info('[JOB] Fetching release groups at offset %d' % offset)
         release_groups = mb.get_release_groups(mbid, limit=LIMIT, offset=offset)
         if release_groups:
+            created = []
             with transaction.commit_on_success():
                 for rg_data in release_groups:
                     # Ignoring releases without a release date or a type.
@@ -123,18 +343,74 @@ def add_release_groups(mbid):
                             date=str_to_date(rg_data['first-release-date']),
                             is_deleted=False)
                         release_group.save()
+                        created.append(release_group.id)
+                Timeline.refill(ids=created)
         if release_groups is None:
-            logging.warning('[ERR] MusicBrainz error, retrying')
-            continue
+            raise JobError('MusicBrainz error at offset %d' % offset)
         if len(release_groups) < LIMIT:
             break
         offset += LIMIT
 
-    return True
+def update_artist(mbid):
+    """Update or merge an artist which was not found by artists.refresh()."""
+    logging.info('[JOB] Updating artist %s' % mbid)
+    try:
+        artist = Artist.objects.get(mbid=mbid)
+    except Artist.DoesNotExist:
+        return
+
+    artist_data = mb.get_artist(mbid)
+    if artist_data is None:
+        raise JobError('MusicBrainz error')
+    if not artist_data:
+        # TODO: deleted from MB?
+        logging.warning('[ERR] Cannot find artist %s, skipping' % mbid)
+    elif artist_data['id'] != artist.mbid:
+        # Requested and returned mbids are different if the artist has been merged.
+        logging.info('[JOB] Merging into artist %s' % artist_data['id'])
+        try:
+            new_artist = Artist.get_by_mbid(artist_data['id'])
+        except (Artist.Blacklisted, Artist.Unknown):
+            return
+        if not new_artist:
+            raise JobError('Could not fetch artist %s' % artist_data['id'])
+        with transaction.commit_on_success():
+            ArtistName.objects.filter(mbid=artist.mbid).update(mbid=new_artist.mbid)
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                UPDATE OR REPLACE "app_userartist"
+                SET "artist_id" = %s
+                WHERE "artist_id" = %s
+                """, [new_artist.id, artist.id])
+            followers = UserArtist.objects.filter(artist=new_artist).count()
+            q = Artist.objects.filter(id=new_artist.id)
+            if followers:
+                # Like UserArtist.add(), check a formerly orphaned artist first.
+                q.filter(followers=0).update(next_check=None)
+            q.update(followers=followers)
+            # The old artist has no followers now, this clears its rows.
+            Timeline.refill(artist_id=artist.id)
+            Timeline.refill(artist_id=new_artist.id)
+            # Delete the artist and its release groups.
+            # Use SQL, delete() is buggy, see Django bug #16426.
+            # TODO: possible FK constraint fail in app_star.
+            cursor.execute(
+                """
+                DELETE FROM "app_releasegroup"
+                WHERE "artist_id" = %s
+                """, [artist.id])
+            cursor.execute(
+                """
+                DELETE FROM "app_artist"
+                WHERE "id" = %s
+                """, [artist.id])
+        logging.info('[JOB] Deleted the artist and its release groups')
+    else:
+        artists.update([(artist, artist_data)])
 
 def get_cover(mbid):
     logging.info('[JOB] Trying to find a cover for %s' % mbid)
-    tools.sleep()
     logging.info('[JOB] Get releases')
     releases = mb.get_releases(mbid, limit=100, offset=0)
     if releases is None:
@@ -156,14 +432,10 @@ def get_cover(mbid):
 
     url = None
     for release in releases:
-        tools.sleep()
         logging.info('[JOB] Checking release %s' % release)
         try:
-            request = Request(
-                'http://musicbrainz.org/release/' + release,
-                headers = {'User-Agent': 'muspy/2.0'})
-            response = urlopen(request)
-            html = response.read()
+            url = MUSICBRAINZ_URL + '/release/' + release
+            html = ratelimit.musicbrainz.get(url).read()
         except:
             logging.warning('[ERR] Could not fetch the release page, skipping')
             continue
@@ -191,9 +463,7 @@ def _fetch_cover(mbid, url):
     logging.info('[JOB] Downloading the cover')
     image = None
     try:
-        request = Request(url, headers = {'User-Agent': 'muspy/2.0'})
-        response = urlopen(request)
-        image = response.read()
+        image = client.get(url).read()
     except:
         logging.warning('[ERR] Could not download, skipping')
         return False
@@ -217,47 +487,83 @@ def _fetch_cover(mbid, url):
         return False
 
 def import_lastfm(user, username, count, period):
+    """Import the top count artists of the Last.fm user, in stages.
+
+    All the Last.fm pages are fetched first. The artists which are
+    already in the database are followed with a few queries. The other
+    ones are looked up with one MB search per batch and followed without
+    their release groups, which are added by background jobs. The
+    artists without an mbid are resolved by name if possible, or queued
+    as name searches.
+
+    """
     logging.info('[JOB] Importing %d artists from Last.fm for user %s' % (count, username))
+    priority = Job.PRIORITIES[Job.IMPORT_LASTFM]
+    mbids, names = _get_lastfm_artists(username, count, period)
+    resolved = resolve_names(names)
+    mbids.extend(mbid for mbid in resolved.values() if mbid)
+    ambiguous = [name for name in names if resolved.get(name) == '']
+    names = [name for name in names if name not in resolved]
+    logging.info('[JOB] Resolved %d names, %d are ambiguous'
+                 % (len(resolved) - len(ambiguous), len(ambiguous)))
+    mbids = [mbid for mbid in mbids if mbid not in Artist.blacklisted]
+
+    known = list(Artist.objects.filter(mbid__in=mbids))
+    added = UserArtist.add_many(user, known)
+    logging.info('[JOB] Followed %d known artists' % added)
+
+    unknown = list(set(mbids) - set(artist.mbid for artist in known))
+    for i in xrange(0, len(unknown), artists.BATCH):
+        batch = unknown[i:i + artists.BATCH]
+        logging.info('[JOB] Looking up %d artists' % len(batch))
+        found = mb.get_artists(batch)
+        if found is None:
+            # The known and the looked up artists are already followed.
+            raise JobError('MusicBrainz error while looking up artists')
+        new = []
+        for mbid in batch:
+            artist_data = found.get(mbid)
+            if artist_data is None:
+                # Merged or not indexed yet, look it up alone.
+                artist_data = mb.get_artist(mbid)
+                if artist_data is None:
+                    raise JobError('Could not fetch artist %s' % mbid)
+                if not artist_data:
+                    logging.info('[JOB] Unknown artist %s, skipping' % mbid)
+                    continue
+            artist, created = Artist.add(mbid, artist_data)
+            if created:
+                Job.add_release_groups(artist, priority)
+            new.append(artist)
+        added = UserArtist.add_many(user, new)
+        logging.info('[JOB] Followed %d new artists' % added)
+
+    if ambiguous:
+        with transaction.commit_on_success():
+            for name in ambiguous:
+                UserSearch(user=user, search=name).save()
+    if names:
+        logging.info('[JOB] Queueing %d artists without an mbid' % len(names))
+        Job.add_artists(user, names, priority)
+
+def _get_lastfm_artists(username, count, period):
+    """Return the mbids and the names without an mbid of the top artists."""
     LIMIT = 50
-    page, added = 0, 0
-    while True:
+    mbids, names = [], []
+    page, seen = 0, 0
+    while seen < count:
         page += 1
-        tools.sleep()
         logging.info('[JOB] Getting page %d' % page)
-        artists = lastfm.get_artists(username, period, LIMIT, page)
-
-        if artists is None:
-            logging.warning('[ERR] Last.fm error, retrying')
-            page -= 1
-            continue
-
-        if not artists: break
-
-        for artist_data in artists:
-            mbid = artist_data.get('mbid', '')
-            if mbid:
-                while True:
-                    # Artist.get_by_mbid will query MB if the artist is not yet
-                    # in the database. Query first to avoid unnecessary sleep.
-                    if not Artist.objects.filter(mbid=mbid).exists():
-                        tools.sleep()
-                    logging.info('[JOB] Getting artist %s' % mbid)
-                    try:
-                        artist = Artist.get_by_mbid(mbid)
-                    except Artist.Blacklisted:
-                        logging.info('[JOB] Blacklisted artist, skipping')
-                        break
-                    except Artist.Unknown:
-                        logging.info('[JOB] Unknown artist, skipping')
-                        break
-                    if not artist:
-                        logging.warning('[ERR] Cannot get the artist data, retrying')
-                        continue
-                    UserArtist.add(user, artist)
-                    break
-            else:
-                add_artist(user, artist_data['name'])
-            added += 1
-            if added == count: break
-
-        if added == count: break
+        page_artists = lastfm.get_artists(username, period, LIMIT, page)
+        if page_artists is None:
+            raise JobError('Last.fm error on page %d' % page)
+        if not page_artists:
+            break
+        for artist_data in page_artists[:count - seen]:
+            mbid = (artist_data.get('mbid') or '').lower()
+            if len(mbid) == 36:
+                mbids.append(mbid)
+            elif artist_data.get('name'):
+                names.append(artist_data['name'])
+        seen += len(page_artists)
+    return mbids, names
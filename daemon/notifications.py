@@ -24,7 +24,8 @@ from daemon import jobs, tools
 
 def send():
     sent_emails = 0
-    sleep = True
+    jobs.process()
+    sleep = False
     while True:
         if sleep:
             jobs.process()
@@ -16,180 +16,578 @@
 # along with muspy.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import hashlib
 import logging
+import multiprocessing
+from Queue import Full, Queue
+import threading
+import time
 
 from django.db import connection, transaction
+from django.db.models import F
 
 from settings import DEBUG
 
+from app import client
 from app.models import *
 import app.musicbrainz as mb
 from app.tools import str_to_date
-from daemon import jobs, notifications, tools
-
-
-def check():
-    logging.info('Start checking artists')
-    sent_notifications = 0
-    checked_artists = 0
-    checked_release_groups = 0
-    day = datetime.datetime.utcnow().day
-    artist = None
-    while True:
-
-        # Get the next artist.
-        artists = Artist.objects.order_by('mbid')
-        if artist:
-            artists = artists.filter(mbid__gt=artist.mbid)
-        try:
-            artist = artists[0]
-        except IndexError:
-            break # last artist
-
-        checked_artists += 1
-
-        # Artist names don't change that often. Update artists at most 3 times
-        # a month, unless we are debugging.
-        if DEBUG or day in (1, 11, 21):
-            jobs.process()
-            tools.sleep()
-            logging.info('Updating artist %s' % artist.mbid)
-            artist_data = mb.get_artist(artist.mbid)
-            if not artist_data:
-                # TODO: musicbrainz/network error or deleted?
-                logging.warning('Could not fetch artist data')
-            elif artist_data['id'] != artist.mbid:
-                # Requested and returned mbids are different if the artist has been merged.
-                logging.info('Merging into artist %s' % artist_data['id'])
-                try:
-                    new_artist = Artist.get_by_mbid(artist_data['id'])
-                except (Artist.Blacklisted, Artist.Unknown):
+from daemon import artists, notifications, scheduler
+
+LIMIT = 100 # release groups per page
+PREFETCH = 10 # pages
+CYCLE_LENGTH = datetime.timedelta(days=1)
+REFRESH_INTERVAL = datetime.timedelta(days=10)
+IDLE_DELAY = 60 # seconds
+LEASE_SIZE = 10 # artists
+WORKER_DELAY = 5 # seconds between email runs with several workers
+SWEEP_BATCH = 50 # artists per search
+SWEEP_DAYS = 30 # first released since
+SWEEP_INTERVAL = datetime.timedelta(hours=3)
+SWEEP_STEP = 5 # searches per sweep_if_due()
+
+
+def check(workers=1):
+    """Check the artists for new release groups and notify the users.
+
+    The cycle checks artists in the order given by the scheduler until
+    none is due or until CYCLE_LENGTH passes. If no artist is due when
+    the cycle starts, wait for one while processing jobs and emails.
+
+    With several workers, each one is a process which leases batches of
+    due artists, see check_artists(). This process sends the emails and
+    processes the jobs meanwhile, and replaces failed workers.
+
+    The process which sends the emails also sweeps for recent release
+    groups every SWEEP_INTERVAL, a few batches at a time, see
+    sweep_if_due().
+
+    The progress is saved to the Checkpoint after each artist, if the
+    daemon is restarted the cycle resumes where it stopped. Return the
+    checkpoint with the cycle stats.
+
+    """
+    checkpoint = Checkpoint.get()
+    if checkpoint:
+        logging.info('Resuming the cycle started at %s after %s'
+                     % (checkpoint.started, checkpoint.artist_mbid or 'no artists'))
+    else:
+        sent_notifications = 0
+        while scheduler.next_artist() is None:
+            sweep_if_due()
+            sent_notifications += notifications.send()
+            time.sleep(IDLE_DELAY)
+
+        logging.info('Start checking artists')
+        # Artist names don't change that often. Update artists every
+        # REFRESH_INTERVAL, not with each cycle, unless we are debugging.
+        state = DaemonState.get()
+        now = datetime.datetime.now()
+        update_artists = (DEBUG or not state.refreshed or
+                          now - state.refreshed >= REFRESH_INTERVAL)
+        if update_artists and artists.refresh() is not None:
+            DaemonState.objects.filter(id=state.id).update(refreshed=now)
+        now = datetime.datetime.now()
+        checkpoint = Checkpoint(
+            started=now, updated=now, update_artists=update_artists,
+            artist_mbid='', sent_notifications=sent_notifications)
+        checkpoint.save()
+
+    if workers > 1:
+        run_workers(checkpoint, workers)
+    else:
+        check_artists(checkpoint, send=True)
+
+    checkpoint = Checkpoint.objects.get(id=checkpoint.id)
+    Checkpoint.reset()
+    return checkpoint
+
+def sweep(after=0, batches=None):
+    """Search for recent release groups of the followed artists.
+
+    Instead of browsing the release groups of each artist, search for
+    the release groups of SWEEP_BATCH artists at once, first released
+    in the last SWEEP_DAYS or upcoming. New ones are added and the users
+    notified just like check() does. This finds most new releases with
+    a fraction of the requests, check() still walks all release groups
+    in the background to catch the rest: edits, deletions and old
+    releases added to MB.
+
+    Only the artists with an id above after are swept, at most batches
+    of them if given. Return the number of requests sent, the number of
+    changed artists and the id of the last swept artist, 0 if none are
+    left.
+
+    """
+    since = (datetime.date.today() - datetime.timedelta(days=SWEEP_DAYS)).isoformat()
+    q = Artist.objects.filter(followers__gt=0, id__gt=after).order_by('id')
+    limit = batches * SWEEP_BATCH if batches is not None else None
+    followed = list(q.values_list('id', 'mbid')[:limit])
+    requests = changed_artists = 0
+    for i in xrange(0, len(followed), SWEEP_BATCH):
+        ids = dict((mbid, id) for id, mbid in followed[i:i + SWEEP_BATCH])
+        query = '(%s) AND firstreleasedate:[%s TO *]' % (
+            ' OR '.join('arid:' + mbid for mbid in sorted(ids)), since)
+        found = {}
+        offset = 0
+        while True:
+            release_groups, count = mb.search_release_groups(query, LIMIT, offset)
+            requests += 1
+            if release_groups is None:
+                logging.warning('Could not search release groups, skipping')
+                break
+            for rg_data in release_groups:
+                for mbid in rg_data.get('artists', []):
+                    if mbid in ids:
+                        found.setdefault(mbid, []).append(rg_data)
+            offset += LIMIT
+            if not release_groups or offset >= count:
+                break
+
+        for mbid, release_groups in found.items():
+            artist = Artist(id=ids[mbid], mbid=mbid)
+            current = load_release_groups(
+                artist, [rg_data['id'] for rg_data in release_groups])
+            checked, changed = apply_page(artist, current, release_groups)
+            if changed:
+                changed_artists += 1
+                Artist.objects.filter(id=artist.id).update(
+                    last_changed=datetime.datetime.now())
+
+    logging.info('Swept %d artists with %d requests, %d changed'
+                 % (len(followed), requests, changed_artists))
+    last = followed[-1][0] if len(followed) == limit else 0
+    return requests, changed_artists, last
+
+def sweep_if_due():
+    """Sweep SWEEP_STEP batches if a sweep is in progress or due.
+
+    A sweep starts every SWEEP_INTERVAL, each call goes on where the
+    previous one stopped: the caller sends the emails and runs the jobs
+    between the calls. The progress is kept in DaemonState.
+
+    """
+    state = DaemonState.get()
+    if not state.sweep_artist_id:
+        now = datetime.datetime.now()
+        if state.sweep_started and now - state.sweep_started < SWEEP_INTERVAL:
+            return
+        logging.info('Sweeping recent release groups')
+        DaemonState.objects.filter(id=state.id).update(sweep_started=now)
+    requests, changed_artists, last = sweep(state.sweep_artist_id, SWEEP_STEP)
+    DaemonState.objects.filter(id=state.id).update(sweep_artist_id=last)
+
+def check_artists(checkpoint, send):
+    """Check the artists leased by this process until none is due.
+
+    Fetching from MB and writing to the database overlap: a fetcher
+    thread leases the artists and queues the release group pages, the
+    current thread applies them. If send is True, also send emails and
+    process jobs between the pages.
+
+    """
+    fetcher = Fetcher(checkpoint.started)
+    fetcher.start()
+    try:
+        artist = diff = None
+        while True:
+            item = fetcher.queue.get()
+            kind = item[0]
+            if kind == Fetcher.ERROR:
+                # The traceback is logged by the fetcher.
+                raise item[1]
+            elif kind == Fetcher.END:
+                break
+            elif kind == Fetcher.ARTIST:
+                artist = item[1]
+                logging.info('Checking artist %s' % artist.mbid)
+                diff = Diff(artist)
+            elif kind == Fetcher.PAGE:
+                if send:
+                    sent = notifications.send()
+                    if sent:
+                        Checkpoint.objects.filter(id=checkpoint.id).update(
+                            sent_notifications=F('sent_notifications') + sent)
+                release_groups = item[1]
+                logging.info('Fetched %s release groups' % len(release_groups))
+                diff.page(release_groups)
+            elif kind == Fetcher.DONE:
+                skipped = 0
+                if diff.done():
+                    logging.info('Release groups unchanged, skipped the diff')
+                    skipped = 1
+                with transaction.commit_on_success():
+                    scheduler.checked(artist, diff.changed)
+                    if diff.fingerprint != artist.fingerprint:
+                        Artist.objects.filter(id=artist.id).update(
+                            fingerprint=diff.fingerprint)
+                    # Other workers update the same checkpoint.
+                    Checkpoint.objects.filter(id=checkpoint.id).update(
+                        checked_artists=F('checked_artists') + 1,
+                        checked_release_groups=F('checked_release_groups') + diff.checked,
+                        skipped_artists=F('skipped_artists') + skipped,
+                        skipped_pages=F('skipped_pages') + diff.pages - diff.diffed_pages,
+                        diffed_pages=F('diffed_pages') + diff.diffed_pages,
+                        diff_time=F('diff_time') + diff.time,
+                        artist_mbid=artist.mbid,
+                        updated=datetime.datetime.now())
+                if send:
+                    # Between artists: the sweep doesn't touch a half-applied one.
+                    sweep_if_due()
+    finally:
+        fetcher.stop()
+        # Don't release while the fetcher could still lease.
+        fetcher.join()
+        # Only artists which were not checked are left, see scheduler.checked().
+        scheduler.release(scheduler.owner())
+
+def run_workers(checkpoint, count):
+    """Run check_artists() in count processes, send emails meanwhile."""
+    processes = {}
+    failures = 0
+    try:
+        while True:
+            while len(processes) < count:
+                # Don't share the database and HTTP connections with the child.
+                connection.close()
+                client.close()
+                process = multiprocessing.Process(target=_worker, args=(checkpoint.id,))
+                process.start()
+                processes[process.pid] = process
+                logging.info('Started worker %d' % process.pid)
+
+            sweep_if_due()
+            sent = notifications.send()
+            if sent:
+                Checkpoint.objects.filter(id=checkpoint.id).update(
+                    sent_notifications=F('sent_notifications') + sent)
+
+            for pid, process in processes.items():
+                if process.is_alive():
                     continue
-                if not new_artist:
+                process.join()
+                if process.exitcode == 0:
                     continue
-                cursor = connection.cursor()
-                cursor.execute(
-                    """
-                    UPDATE OR REPLACE "app_userartist"
-                    SET "artist_id" = %s
-                    WHERE "artist_id" = %s
-                    """, [new_artist.id, artist.id])
-                # Delete the artist and its release groups.
-                # Use SQL, delete() is buggy, see Django bug #16426.
-                # TODO: possible FK constraint fail in app_star.
-                cursor.execute(
-                    """
-                    DELETE FROM "app_releasegroup"
-                    WHERE "artist_id" = %s
-                    """, [artist.id])
-                logging.info('Deleted release groups')
-                cursor.execute(
-                    """
-                    DELETE FROM "app_artist"
-                    WHERE "id" = %s
-                    """, [artist.id])
-                logging.info('Deleted the artist')
-                continue
-            else:
-                # Update artist info if changed.
-                updated = False
-                if artist.name != artist_data['name']:
-                    artist.name = artist_data['name']
-                    updated = True
-                if artist.sort_name != artist_data['sort-name']:
-                    artist.sort_name = artist_data['sort-name']
-                    updated = True
-                if artist.disambiguation != artist_data.get('disambiguation', ''):
-                    artist.disambiguation = artist_data.get('disambiguation', '')
-                    updated = True
-                if updated:
-                    logging.info('Artist changed, updating')
-                    artist.save()
-        else:
-            logging.info('Checking artist %s' % artist.mbid)
-
-        current = {rg.mbid: rg for rg in ReleaseGroup.objects.filter(artist=artist)}
-
-        # Get release groups
-        LIMIT = 100
+                # Let the other workers check its artists.
+                logging.error('Worker %d failed, releasing its artists' % pid)
+                scheduler.release(scheduler.owner(pid))
+                failures += 1
+                if failures > count:
+                    raise WorkerError('Too many failed workers')
+                del processes[pid]
+            alive = [process for process in processes.values() if process.is_alive()]
+            if len(processes) == count and not alive:
+                break # all workers are done
+            if alive:
+                # Wake up early if the worker exits.
+                alive[0].join(WORKER_DELAY)
+    finally:
+        for pid, process in processes.items():
+            if process.is_alive():
+                process.terminate()
+                process.join()
+                scheduler.release(scheduler.owner(pid))
+
+    sent = notifications.send()
+    Checkpoint.objects.filter(id=checkpoint.id).update(
+        sent_notifications=F('sent_notifications') + sent)
+
+def _worker(checkpoint_id):
+    try:
+        checkpoint = Checkpoint.objects.get(id=checkpoint_id)
+        check_artists(checkpoint, send=False)
+    except:
+        logging.exception('Worker error')
+        raise
+    finally:
+        connection.close()
+
+
+class Fetcher(threading.Thread):
+    """Lease the due artists, queue their release groups.
+
+    For each artist queue (ARTIST, artist), then (PAGE,
+    release_groups) for each page and finally (DONE,). Once no artists
+    are due, queue (END,). If the thread fails, queue (ERROR,
+    exception). The leases are left to check_artists(): an artist which
+    was fetched is still leased until it's applied and checked.
+
+    """
+    ARTIST, PAGE, DONE, END, ERROR = range(5)
+
+    def __init__(self, started):
+        super(Fetcher, self).__init__(name='fetcher')
+        self.daemon = True
+        self.queue = Queue(PREFETCH)
+        self._started = started
+        self._stopped = threading.Event()
+        self._owner = scheduler.owner()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        try:
+            self._run()
+            self._put(self.END)
+        except Stopped:
+            pass
+        except Exception as e:
+            logging.exception('Fetcher error')
+            self._put(self.ERROR, e)
+        finally:
+            # Each thread has its own connection.
+            connection.close()
+
+    def _run(self):
+        while datetime.datetime.now() - self._started < CYCLE_LENGTH:
+            artists = scheduler.lease(self._owner, LEASE_SIZE)
+            if not artists:
+                break # no more due artists
+            for artist in artists:
+                if self._stopped.is_set():
+                    raise Stopped()
+                if not scheduler.renew(artist, self._owner):
+                    continue # the lease expired, another worker took it
+                self._fetch(artist)
+
+    def _fetch(self, artist):
+        self._put(self.ARTIST, artist)
+
         offset = 0
         while True:
-            sent_notifications += notifications.send()
+            if self._stopped.is_set():
+                raise Stopped()
             release_groups = mb.get_release_groups(artist.mbid, LIMIT, offset)
             if release_groups is None:
                 logging.warning('Could not fetch release groups, retrying')
                 continue
-            logging.info('Fetched %s release groups' % len(release_groups))
-            with transaction.commit_on_success():
-                for rg_data in release_groups:
-                    mbid = rg_data['id']
-                    # Ignore releases without a release date or a type.
-                    release_date = str_to_date(rg_data.get('first-release-date'))
-                    if not release_date or not rg_data.get('type'):
-                        if mbid in current:
-                            release_group = current[mbid]
-                            if not release_group.is_deleted:
-                                release_group.is_deleted = True
-                                release_group.save()
-                                logging.info('Deleted release group %s' % mbid)
-                        continue
-
-                    checked_release_groups += 1
-                    if mbid in current:
-                        release_group = current[mbid]
-
-                        updated = False
-                        if release_group.is_deleted:
-                            release_group.is_deleted = False
-                            updated = True
-                        # Work-around MBS-4285.
-                        if release_group.name != rg_data['title'] and rg_data['title']:
-                            release_group.name = rg_data['title']
-                            updated = True
-                        if release_group.type != rg_data['type']:
-                            release_group.type = rg_data['type']
-                            updated = True
-                        if release_group.date != release_date:
-                            release_group.date = release_date
-                            updated = True
-                        if updated:
-                            release_group.save()
-                            logging.info('Updated release group %s' % mbid)
-
-                        del current[mbid]
-                    elif rg_data['title']:
-                        release_group = ReleaseGroup(
-                            artist=artist,
-                            mbid=rg_data['id'],
-                            name=rg_data['title'],
-                            type=rg_data['type'],
-                            date=release_date,
-                            is_deleted=False)
-                        release_group.save()
-                        logging.info('Created release group %s' % mbid)
-
-                        # Notify users
-                        cursor = connection.cursor()
-                        cursor.execute(
-                            """
-                            INSERT INTO "app_notification" ("user_id", "release_group_id")
-                            SELECT "app_userartist"."user_id", "app_releasegroup"."id"
-                            FROM "app_userartist"
-                            JOIN "app_artist" ON "app_artist"."id" = "app_userartist"."artist_id"
-                            JOIN "app_releasegroup" ON "app_releasegroup"."artist_id" = "app_artist"."id"
-                            WHERE "app_releasegroup"."id" = %s
-                            """, [release_group.id])
-                        logging.info('Will notify %d users' % cursor.rowcount)
-
+            self._put(self.PAGE, release_groups)
             if len(release_groups) < LIMIT: break
             offset += LIMIT
+        self._put(self.DONE)
+
+    def _put(self, *item):
+        # Don't block forever if check() has failed.
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Full:
+                pass
+        raise Stopped()
+
+
+class Stopped(Exception): pass
+class WorkerError(Exception): pass
+
+
+class Diff(object):
+    """Apply the release groups of an artist page by page.
+
+    Each page is fingerprinted, see fingerprint(). As long as the pages
+    match the fingerprints saved by the last check, the release groups
+    are not loaded from the database and not diffed.
+
+    """
+    def __init__(self, artist):
+        self.artist = artist
+        self.checked = 0 # release groups
+        self.changed = False
+        self.pages = 0
+        self.diffed_pages = 0
+        self.time = 0.0 # seconds spent diffing
+        self._old = artist.fingerprint.split(',') if artist.fingerprint else []
+        self._new = []
+        self._seen = [] # mbids on the skipped pages
+        self._current = None
+
+    @property
+    def fingerprint(self):
+        return ','.join(self._new)
+
+    def page(self, release_groups):
+        self._new.append(fingerprint(release_groups))
+        self.pages += 1
+        if self._current is None and self._new == self._old[:self.pages]:
+            self._seen.extend(rg_data['id'] for rg_data in release_groups)
+            self.checked += len([
+                rg_data for rg_data in release_groups
+                if str_to_date(rg_data.get('first-release-date')) and rg_data.get('type')])
+            return
+
+        start = time.time()
+        self._load()
+        checked, changed = apply_page(self.artist, self._current, release_groups)
+        self.checked += checked
+        self.changed = self.changed or changed
+        self.diffed_pages += 1
+        self.time += time.time() - start
+
+    def done(self):
+        """Delete the missing release groups, return True if nothing was diffed."""
+        if self._current is None and self._new == self._old:
+            return True
+        start = time.time()
+        self._load()
+        self.changed = delete_missing(self._current) or self.changed
+        self.time += time.time() - start
+        return False
+
+    def _load(self):
+        if self._current is None:
+            self._current = load_release_groups(self.artist)
+            for mbid in self._seen:
+                self._current.pop(mbid, None)
+
+
+def fingerprint(release_groups):
+    """Return a short hash of the fields we keep from a page of release groups."""
+    items = sorted(
+        u'\t'.join([rg_data['id'], rg_data.get('title') or u'', rg_data.get('type') or u'',
+                    rg_data.get('first-release-date') or u''])
+        for rg_data in release_groups)
+    return hashlib.sha1(u'\n'.join(items).encode('utf-8')).hexdigest()[:16]
+
+def load_release_groups(artist, mbids=None):
+    """Return {mbid: (id, name, type, date, is_deleted)} for the artist.
+
+    If mbids is given, only load these release groups.
+
+    """
+    sql = """
+        SELECT "mbid", "id", "name", "type", "date", "is_deleted"
+        FROM "app_releasegroup"
+        WHERE "artist_id" = %s
+        """
+    params = [artist.id]
+    if mbids:
+        sql += 'AND "mbid" IN (%s)' % ', '.join(['%s'] * len(mbids))
+        params += list(mbids)
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+def apply_page(artist, current, release_groups):
+    """Apply a page of release groups fetched from MB.
+
+    Diff the page against current (see load_release_groups) and remove
+    the release groups found on the page from it. The changes are
+    written with a fixed number of statements. current can be stale (the
+    sweep or another worker could have added some release groups since
+    it was loaded), the new ones already there are skipped. The users
+    are notified about all inserted release groups at once, unless the
+    artist was never checked. Return the number of checked release
+    groups and whether anything changed.
+
+    """
+    checked = 0
+    deleted, updated, created = [], [], []
+    created_mbids = set()
+    for rg_data in release_groups:
+        mbid = rg_data['id']
+        # Ignore releases without a release date or a type.
+        release_date = str_to_date(rg_data.get('first-release-date'))
+        if not release_date or not rg_data.get('type'):
+            if mbid in current:
+                id, name, type, date, is_deleted = current.pop(mbid)
+                if not is_deleted:
+                    deleted.append(id)
+            continue
+
+        checked += 1
+        if mbid in current:
+            id, name, type, date, is_deleted = current.pop(mbid)
+            # Work-around MBS-4285.
+            title = rg_data['title'] or name
+            if (is_deleted or title != name or rg_data['type'] != type or
+                release_date != date):
+                updated.append((title, rg_data['type'], release_date, False, id))
+        elif rg_data['title'] and mbid not in created_mbids:
+            created_mbids.add(mbid)
+            created.append(
+                (artist.id, mbid, rg_data['title'], rg_data['type'], release_date, False))
+
+    if not (deleted or updated or created):
+        return checked, False
+
+    with transaction.commit_on_success():
+        cursor = connection.cursor()
+        if deleted:
+            _soft_delete(cursor, deleted)
+        if updated:
+            cursor.executemany(
+                """
+                UPDATE "app_releasegroup"
+                SET "name" = %s, "type" = %s, "date" = %s, "is_deleted" = %s
+                WHERE "id" = %s
+                """, updated)
+        inserted = []
+        if created:
+            # The first write of the transaction takes the lock, nobody
+            # can add release groups until it ends.
+            cursor.execute('UPDATE "app_releasegroup" SET "id" = "id" WHERE 0')
+            select = """
+                SELECT "id", "mbid" FROM "app_releasegroup"
+                WHERE "artist_id" = %%s AND "mbid" IN (%s)
+                """
+            cursor.execute(select % ', '.join(['%s'] * len(created)),
+                           [artist.id] + [row[1] for row in created])
+            present = set(row[1] for row in cursor.fetchall())
+            created = [row for row in created if row[1] not in present]
+        if created:
+            cursor.executemany(
+                """
+                INSERT INTO "app_releasegroup"
+                ("artist_id", "mbid", "name", "type", "date", "is_deleted")
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """, created)
+            cursor.execute(select % ', '.join(['%s'] * len(created)),
+                           [artist.id] + [row[1] for row in created])
+            inserted = [row[0] for row in cursor.fetchall()]
+        notified = 0
+        if inserted:
+            # Notify users, unless the artist was never checked: its
+            # release groups could still be loading, see
+            # Job.add_release_groups(), the back catalogue isn't news.
+            cursor.execute(
+                """
+                INSERT INTO "app_notification" ("user_id", "release_group_id")
+                SELECT "app_userartist"."user_id", "app_releasegroup"."id"
+                FROM "app_userartist"
+                JOIN "app_releasegroup" ON "app_releasegroup"."artist_id" = "app_userartist"."artist_id"
+                JOIN "app_artist" ON "app_artist"."id" = "app_userartist"."artist_id"
+                WHERE "app_userartist"."artist_id" = %%s
+                AND "app_artist"."last_checked" IS NOT NULL
+                AND "app_releasegroup"."id" IN (%s)
+                """ % ', '.join(['%s'] * len(inserted)), [artist.id] + inserted)
+            notified = cursor.rowcount
+        Timeline.refill(ids=deleted + [row[-1] for row in updated] + inserted)
+    logging.info('Created %d, updated %d and deleted %d release groups'
+                 % (len(inserted), len(updated), len(deleted)))
+    if inserted:
+        logging.info('Will notify %d users' % notified)
+    return checked, True
+
+def delete_missing(current):
+    """Delete release groups which are no longer returned by MB.
+
+    Return True if anything was deleted.
 
-        with transaction.commit_on_success():
-            for mbid in current:
-                release_group = current[mbid]
-                if not release_group.is_deleted:
-                    release_group.is_deleted = True
-                    release_group.save()
-                    logging.info('Deleted release group %s' % mbid)
+    """
+    deleted = [rg[0] for rg in current.values() if not rg[4]]
+    if not deleted:
+        return False
+    with transaction.commit_on_success():
+        _soft_delete(connection.cursor(), deleted)
+        Timeline.refill(ids=deleted)
+    logging.info('Deleted %d release groups' % len(deleted))
+    return True
 
-    return (checked_artists, checked_release_groups, sent_notifications)
+def _soft_delete(cursor, ids):
+    cursor.executemany(
+        """
+        UPDATE "app_releasegroup"
+        SET "is_deleted" = %s
+        WHERE "id" = %s
+        """, [(True, id) for id in ids])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012 Alexander Kojevnikov <alexander@kojevnikov.com>
+#
+# muspy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# muspy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with muspy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decide which artist to check next.
+
+Each artist has the time of its next check. Artists which are due are
+checked in the order of their next check time, the ones with more
+followers first. Once checked, the next check is scheduled after an
+interval which depends on how active the artist is and how many users
+follow it:
+
+* Active artists (changed recently or with upcoming releases) are
+  checked every ACTIVE_INTERVAL, others every DORMANT_INTERVAL.
+* The interval is divided by 1 + log2(1 + followers).
+* Orphaned artists (nobody follows them) are checked every
+  ORPHAN_INTERVAL. Following one makes it due immediately, see
+  UserArtist.add(). The compact command archives them altogether.
+
+Several workers can check artists at the same time, each one leases a
+batch of due artists. The lease is renewed when the worker starts
+checking an artist and cleared once it's checked. If a worker dies, its
+artists become available again when the lease expires or when the
+worker's parent releases them.
+
+"""
+
+from datetime import datetime, timedelta
+import math
+import os
+import socket
+
+from django.db import transaction
+from django.db.models import Q
+
+from app.models import Artist, ReleaseGroup, UserArtist
+
+ACTIVE_INTERVAL = timedelta(days=2)
+DORMANT_INTERVAL = timedelta(days=14)
+MIN_INTERVAL = timedelta(hours=6)
+ORPHAN_INTERVAL = timedelta(days=90)
+LEASE_TIME = timedelta(hours=1)
+ACTIVE_PERIOD = timedelta(days=180)
+
+
+def due(now=None):
+    """Return the artists due for a check, most urgent first."""
+    now = now or datetime.now()
+    q = Artist.objects.filter(Q(next_check__isnull=True) | Q(next_check__lte=now))
+    return q.order_by('next_check', '-followers')
+
+def next_artist(exclude=()):
+    """Return the most urgent artist, skip artists with ids in exclude."""
+    q = due()
+    if exclude:
+        q = q.exclude(id__in=list(exclude))
+    try:
+        return q[0]
+    except IndexError:
+        return None
+
+def owner(pid=None):
+    """Return the lease owner name of the process."""
+    return '%s:%d' % (socket.gethostname(), pid or os.getpid())
+
+def lease(owner, count, now=None):
+    """Lease up to count due artists to owner, return them.
+
+    Return an empty list only if no artists are due.
+
+    """
+    now = now or datetime.now()
+    free = Q(lease_until__isnull=True) | Q(lease_until__lte=now)
+    while True:
+        ids = list(due(now).filter(free).values_list('id', flat=True)[:count])
+        if not ids:
+            return []
+        with transaction.commit_on_success():
+            # Another worker could have taken some of them meanwhile.
+            leased = Artist.objects.filter(free, id__in=ids).update(
+                lease_owner=owner, lease_until=now + LEASE_TIME)
+        if leased:
+            q = Artist.objects.filter(id__in=ids, lease_owner=owner)
+            return list(q.order_by('next_check', '-followers'))
+
+def renew(artist, owner, now=None):
+    """Extend the lease, return False if owner no longer holds it."""
+    now = now or datetime.now()
+    q = Artist.objects.filter(id=artist.id, lease_owner=owner)
+    return q.update(lease_until=now + LEASE_TIME) > 0
+
+def release(owner):
+    """Release the artists leased by owner which are not checked yet."""
+    Artist.objects.filter(lease_owner=owner).update(lease_owner='', lease_until=None)
+
+def checked(artist, changed, now=None):
+    """Record the check and schedule the next one."""
+    now = now or datetime.now()
+    last_changed = now if changed else artist.last_changed
+    followers = UserArtist.objects.filter(artist=artist).count()
+    today = int(now.strftime('%Y%m%d'))
+    upcoming = ReleaseGroup.objects.filter(
+        artist=artist, date__gte=today, is_deleted=False).exists()
+    next_check = now + interval(followers, last_changed, upcoming, now)
+    # Don't use save(), the artist could have been merged and deleted.
+    Artist.objects.filter(id=artist.id).update(
+        followers=followers, last_checked=now, last_changed=last_changed,
+        next_check=next_check, lease_owner='', lease_until=None)
+
+def interval(followers, last_changed, upcoming, now):
+    if not followers:
+        return ORPHAN_INTERVAL
+    active = upcoming or (last_changed and now - last_changed < ACTIVE_PERIOD)
+    base = ACTIVE_INTERVAL if active else DORMANT_INTERVAL
+    seconds = _seconds(base) / (1 + math.log(1 + followers, 2))
+    return max(MIN_INTERVAL, timedelta(seconds=seconds))
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds
@@ -21,9 +21,9 @@ from django.db import connection
 
 
 def sleep():
-    """Sleep to avoid clogging up MusicBrainz servers.
+    """Pause between notification emails.
 
-    Call it before each MB request.
+    Web service requests don't need it, they are throttled by app.ratelimit.
 
     """
     # Don't keep an open database connection while sleeping.
@@ -0,0 +1,14 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_artist" ADD COLUMN "followers" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_artist" ADD COLUMN "last_checked" datetime;
+ALTER TABLE "app_artist" ADD COLUMN "last_changed" datetime;
+ALTER TABLE "app_artist" ADD COLUMN "next_check" datetime;
+
+CREATE INDEX "app_artist_next_check" ON "app_artist" ("next_check", "followers" DESC);
+
+UPDATE "app_artist" SET "followers" = (
+    SELECT COUNT(*) FROM "app_userartist"
+    WHERE "app_userartist"."artist_id" = "app_artist"."id");
+
+COMMIT;
@@ -0,0 +1,14 @@
+BEGIN TRANSACTION;
+
+CREATE TABLE "app_checkpoint" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "started" datetime NOT NULL,
+    "updated" datetime NOT NULL,
+    "update_artists" bool NOT NULL,
+    "artist_mbid" varchar(36) NOT NULL,
+    "checked_artists" integer NOT NULL,
+    "checked_release_groups" integer NOT NULL,
+    "sent_notifications" integer NOT NULL
+);
+
+COMMIT;
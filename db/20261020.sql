@@ -0,0 +1,6 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_artist" ADD COLUMN "lease_owner" varchar(64) NOT NULL DEFAULT '';
+ALTER TABLE "app_artist" ADD COLUMN "lease_until" datetime;
+
+COMMIT;
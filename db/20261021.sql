@@ -0,0 +1,9 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_artist" ADD COLUMN "fingerprint" text NOT NULL DEFAULT '';
+ALTER TABLE "app_checkpoint" ADD COLUMN "skipped_artists" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_checkpoint" ADD COLUMN "skipped_pages" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_checkpoint" ADD COLUMN "diffed_pages" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_checkpoint" ADD COLUMN "diff_time" real NOT NULL DEFAULT 0;
+
+COMMIT;
@@ -0,0 +1,25 @@
+BEGIN TRANSACTION;
+
+CREATE TABLE "app_dumpartist" (
+    "mbid" varchar(36) NOT NULL PRIMARY KEY,
+    "name" varchar(512) NOT NULL,
+    "sort_name" varchar(512) NOT NULL,
+    "disambiguation" varchar(512) NOT NULL
+);
+CREATE TABLE "app_dumpfile" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "name" varchar(255) NOT NULL UNIQUE,
+    "applied" datetime NOT NULL
+);
+CREATE TABLE "app_dumpreleasegroup" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "artist_mbid" varchar(36) NOT NULL,
+    "mbid" varchar(36) NOT NULL,
+    "name" varchar(512) NOT NULL,
+    "type" varchar(16) NOT NULL,
+    "date" integer NOT NULL,
+    UNIQUE ("artist_mbid", "mbid")
+);
+CREATE INDEX "app_dumpreleasegroup_mbid" ON "app_dumpreleasegroup" ("mbid");
+
+COMMIT;
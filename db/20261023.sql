@@ -0,0 +1,11 @@
+BEGIN TRANSACTION;
+
+CREATE INDEX "app_releasegroup_artist_id_date" ON "app_releasegroup" ("artist_id", "date" DESC);
+
+DROP INDEX "app_notification_user_id";
+DROP INDEX "app_star_user_id";
+DROP INDEX "app_userartist_user_id";
+
+COMMIT;
+
+ANALYZE;
@@ -0,0 +1,42 @@
+BEGIN TRANSACTION;
+
+CREATE TABLE "app_timeline" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "user_id" integer NOT NULL REFERENCES "auth_user" ("id"),
+    "release_group_id" integer NOT NULL REFERENCES "app_releasegroup" ("id"),
+    "date" integer NOT NULL,
+    "is_starred" bool NOT NULL,
+    UNIQUE ("release_group_id", "user_id")
+);
+CREATE INDEX "app_timeline_user_id_date" ON "app_timeline" ("user_id", "is_starred" DESC, "date" DESC, "release_group_id");
+
+INSERT INTO "app_timeline" ("user_id", "release_group_id", "date", "is_starred")
+SELECT
+    "app_userartist"."user_id",
+    "app_releasegroup"."id",
+    "app_releasegroup"."date",
+    EXISTS (
+        SELECT 1 FROM "app_star"
+        WHERE "app_star"."user_id" = "app_userartist"."user_id"
+        AND "app_star"."release_group_id" = "app_releasegroup"."id")
+FROM "app_releasegroup"
+JOIN "app_userartist" ON "app_userartist"."artist_id" = "app_releasegroup"."artist_id"
+JOIN "app_userprofile" ON "app_userprofile"."user_id" = "app_userartist"."user_id"
+WHERE NOT "app_releasegroup"."is_deleted"
+AND (CASE "app_releasegroup"."type"
+    WHEN 'Album' THEN "app_userprofile"."notify_album"
+    WHEN 'Single' THEN "app_userprofile"."notify_single"
+    WHEN 'EP' THEN "app_userprofile"."notify_ep"
+    WHEN 'Live' THEN "app_userprofile"."notify_live"
+    WHEN 'Compilation' THEN "app_userprofile"."notify_compilation"
+    WHEN 'Remix' THEN "app_userprofile"."notify_remix"
+    WHEN 'Soundtrack' THEN "app_userprofile"."notify_other"
+    WHEN 'Spokenword' THEN "app_userprofile"."notify_other"
+    WHEN 'Interview' THEN "app_userprofile"."notify_other"
+    WHEN 'Audiobook' THEN "app_userprofile"."notify_other"
+    WHEN 'Other' THEN "app_userprofile"."notify_other"
+    ELSE 0 END);
+
+COMMIT;
+
+ANALYZE;
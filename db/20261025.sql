@@ -0,0 +1,13 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_job" ADD COLUMN "priority" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_job" ADD COLUMN "run_at" datetime NOT NULL DEFAULT '1970-01-01 00:00:00';
+ALTER TABLE "app_job" ADD COLUMN "lease_owner" varchar(64) NOT NULL DEFAULT '';
+ALTER TABLE "app_job" ADD COLUMN "lease_until" datetime;
+CREATE INDEX "app_job_priority_run_at" ON "app_job" ("priority", "run_at");
+
+-- See Job.PRIORITIES.
+UPDATE "app_job" SET "priority" = 1 WHERE "type" = 4;
+UPDATE "app_job" SET "priority" = 2 WHERE "type" = 5;
+
+COMMIT;
@@ -0,0 +1,17 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_job" ADD COLUMN "attempts" integer NOT NULL DEFAULT 0;
+ALTER TABLE "app_job" ADD COLUMN "error" text NOT NULL DEFAULT '';
+
+CREATE TABLE "app_deadjob" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "user_id" integer REFERENCES "auth_user" ("id"),
+    "type" integer NOT NULL,
+    "data" text NOT NULL,
+    "attempts" integer NOT NULL,
+    "error" text NOT NULL,
+    "failed" datetime NOT NULL
+);
+CREATE INDEX "app_deadjob_user_id" ON "app_deadjob" ("user_id");
+
+COMMIT;
@@ -0,0 +1,12 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_job" ADD COLUMN "key" varchar(64);
+ALTER TABLE "app_job" ADD COLUMN "coalesced" integer NOT NULL DEFAULT 0;
+
+-- Merge the queued duplicates, see Job.COALESCED.
+DELETE FROM "app_job" WHERE "type" IN (2, 3, 5) AND "id" NOT IN (
+    SELECT MIN("id") FROM "app_job" WHERE "type" IN (2, 3, 5) GROUP BY "type", "data");
+UPDATE "app_job" SET "key" = "type" || ':' || "data" WHERE "type" IN (2, 3, 5);
+CREATE UNIQUE INDEX "app_job_key" ON "app_job" ("key");
+
+COMMIT;
@@ -0,0 +1,12 @@
+BEGIN TRANSACTION;
+
+-- Fill it with "./manage.py artistnames --rebuild".
+CREATE TABLE "app_artistname" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "name" varchar(512) NOT NULL UNIQUE,
+    "mbid" varchar(36) NOT NULL,
+    "searched" bool NOT NULL,
+    "updated" datetime NOT NULL
+);
+
+COMMIT;
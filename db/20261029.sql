@@ -0,0 +1,9 @@
+BEGIN TRANSACTION;
+
+CREATE TABLE "app_daemonstate" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "sweep_started" datetime,
+    "sweep_artist_id" integer NOT NULL
+);
+
+COMMIT;
@@ -0,0 +1,5 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE "app_daemonstate" ADD COLUMN "refreshed" datetime;
+
+COMMIT;
@@ -6,13 +6,84 @@ CREATE TABLE "app_artist" (
     "mbid" varchar(36) NOT NULL UNIQUE,
     "name" varchar(512) NOT NULL,
     "sort_name" varchar(512) NOT NULL,
+    "disambiguation" varchar(512) NOT NULL,
+    "followers" integer NOT NULL DEFAULT 0,
+    "last_checked" datetime,
+    "last_changed" datetime,
+    "next_check" datetime,
+    "lease_owner" varchar(64) NOT NULL DEFAULT '',
+    "lease_until" datetime,
+    "fingerprint" text NOT NULL DEFAULT ''
+);
+CREATE TABLE "app_artistname" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "name" varchar(512) NOT NULL UNIQUE,
+    "mbid" varchar(36) NOT NULL,
+    "searched" bool NOT NULL,
+    "updated" datetime NOT NULL
+);
+CREATE TABLE "app_checkpoint" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "started" datetime NOT NULL,
+    "updated" datetime NOT NULL,
+    "update_artists" bool NOT NULL,
+    "artist_mbid" varchar(36) NOT NULL,
+    "checked_artists" integer NOT NULL,
+    "checked_release_groups" integer NOT NULL,
+    "sent_notifications" integer NOT NULL,
+    "skipped_artists" integer NOT NULL DEFAULT 0,
+    "skipped_pages" integer NOT NULL DEFAULT 0,
+    "diffed_pages" integer NOT NULL DEFAULT 0,
+    "diff_time" real NOT NULL DEFAULT 0
+);
+CREATE TABLE "app_daemonstate" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "sweep_started" datetime,
+    "sweep_artist_id" integer NOT NULL,
+    "refreshed" datetime
+);
+CREATE TABLE "app_deadjob" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "user_id" integer REFERENCES "auth_user" ("id"),
+    "type" integer NOT NULL,
+    "data" text NOT NULL,
+    "attempts" integer NOT NULL,
+    "error" text NOT NULL,
+    "failed" datetime NOT NULL
+);
+CREATE TABLE "app_dumpartist" (
+    "mbid" varchar(36) NOT NULL PRIMARY KEY,
+    "name" varchar(512) NOT NULL,
+    "sort_name" varchar(512) NOT NULL,
     "disambiguation" varchar(512) NOT NULL
 );
+CREATE TABLE "app_dumpfile" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "name" varchar(255) NOT NULL UNIQUE,
+    "applied" datetime NOT NULL
+);
+CREATE TABLE "app_dumpreleasegroup" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "artist_mbid" varchar(36) NOT NULL,
+    "mbid" varchar(36) NOT NULL,
+    "name" varchar(512) NOT NULL,
+    "type" varchar(16) NOT NULL,
+    "date" integer NOT NULL,
+    UNIQUE ("artist_mbid", "mbid")
+);
 CREATE TABLE "app_job" (
     "id" integer NOT NULL PRIMARY KEY,
     "user_id" integer REFERENCES "auth_user" ("id"),
     "type" integer NOT NULL,
-    "data" text NOT NULL
+    "data" text NOT NULL,
+    "priority" integer NOT NULL DEFAULT 0,
+    "run_at" datetime NOT NULL DEFAULT '1970-01-01 00:00:00',
+    "lease_owner" varchar(64) NOT NULL DEFAULT '',
+    "lease_until" datetime,
+    "attempts" integer NOT NULL DEFAULT 0,
+    "error" text NOT NULL DEFAULT '',
+    "key" varchar(64) UNIQUE,
+    "coalesced" integer NOT NULL DEFAULT 0
 );
 CREATE TABLE "app_notification" (
     "id" integer NOT NULL PRIMARY KEY,
@@ -36,6 +107,14 @@ CREATE TABLE "app_star" (
     "release_group_id" integer NOT NULL REFERENCES "app_releasegroup" ("id"),
     UNIQUE ("user_id", "release_group_id")
 );
+CREATE TABLE "app_timeline" (
+    "id" integer NOT NULL PRIMARY KEY,
+    "user_id" integer NOT NULL REFERENCES "auth_user" ("id"),
+    "release_group_id" integer NOT NULL REFERENCES "app_releasegroup" ("id"),
+    "date" integer NOT NULL,
+    "is_starred" bool NOT NULL,
+    UNIQUE ("release_group_id", "user_id")
+);
 CREATE TABLE "app_userartist" (
     "id" integer NOT NULL PRIMARY KEY,
     "user_id" integer NOT NULL REFERENCES "auth_user" ("id"),
@@ -114,16 +193,19 @@ CREATE TABLE "piston_token" (
     "consumer_id" integer NOT NULL REFERENCES "piston_consumer" ("id")
 );
 CREATE INDEX "app_artist_sort_name" ON "app_artist" ("sort_name");
+CREATE INDEX "app_artist_next_check" ON "app_artist" ("next_check", "followers" DESC);
+CREATE INDEX "app_dumpreleasegroup_mbid" ON "app_dumpreleasegroup" ("mbid");
+CREATE INDEX "app_deadjob_user_id" ON "app_deadjob" ("user_id");
+CREATE INDEX "app_job_priority_run_at" ON "app_job" ("priority", "run_at");
 CREATE INDEX "app_job_user_id" ON "app_job" ("user_id");
 CREATE INDEX "app_notification_release_group_id" ON "app_notification" ("release_group_id");
-CREATE INDEX "app_notification_user_id" ON "app_notification" ("user_id");
 CREATE INDEX "app_releasegroup_artist_id" ON "app_releasegroup" ("artist_id");
+CREATE INDEX "app_releasegroup_artist_id_date" ON "app_releasegroup" ("artist_id", "date" DESC);
 CREATE INDEX "app_releasegroup_date" ON "app_releasegroup" ("date" DESC);
 CREATE INDEX "app_releasegroup_mbid" ON "app_releasegroup" ("mbid");
 CREATE INDEX "app_star_release_group_id" ON "app_star" ("release_group_id");
-CREATE INDEX "app_star_user_id" ON "app_star" ("user_id");
+CREATE INDEX "app_timeline_user_id_date" ON "app_timeline" ("user_id", "is_starred" DESC, "date" DESC, "release_group_id");
 CREATE INDEX "app_userartist_artist_id" ON "app_userartist" ("artist_id");
-CREATE INDEX "app_userartist_user_id" ON "app_userartist" ("user_id");
 CREATE INDEX "app_userprofile_activation_code" ON "app_userprofile" ("activation_code");
 CREATE INDEX "app_userprofile_legacy_id" ON "app_userprofile" ("legacy_id");
 CREATE INDEX "app_userprofile_reset_code" ON "app_userprofile" ("reset_code");
@@ -31,6 +31,10 @@ EMAIL_PORT = 1025
 
 LASTFM_API_KEY='change me'
 
+# Web services, point them to bench/stub.py for benchmarks.
+MUSICBRAINZ_URL = 'http://musicbrainz.org'
+LASTFM_URL = 'http://ws.audioscrobbler.com'
+
 ########################################################################
 
 ADMINS = (('admin', 'info@muspy.com'),)